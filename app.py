@@ -1,14 +1,26 @@
 import streamlit as st
 import pandas as pd
 import sqlalchemy
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 import requests
 import json
 import re
+import contextlib
 import hashlib
-from pathlib import Path
+import os
+import time
 from datetime import datetime
 import warnings
+from cache import (
+    DEFAULT_CACHE_POLICY, CacheEntry, cache_stats, decode_entry, encode_entry, failed_request_cache,
+    get_cache_backend, get_result_cache, intent_engine_cache, response_memory_cache, value_size
+)
+from question_templates import CATEGORICAL_HINTS, QuestionTemplater
+from intent_engine import IntentEngine, default_intent_engine, rules_from_schema
+from schema_index import SchemaIndex
+from gemini_client import get_gemini_client, iter_sse_text
+from resilience import gemini_circuit_breaker, gemini_single_flight
+from warmup import background_refresher, cache_warmer
 warnings.filterwarnings("ignore")
 
 # Page configuration
@@ -103,111 +115,618 @@ def fix_dataframe_types(df):
     
     return df_fixed
 
+# Functions whose result changes between runs of the same SQL
+NON_DETERMINISTIC_SQL = re.compile(
+    r'\b(NOW|CURDATE|CURTIME|SYSDATE|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|UNIX_TIMESTAMP|'
+    r'UTC_DATE|UTC_TIME|UTC_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP|CURRENT_USER|RAND|UUID|UUID_SHORT|'
+    r'CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT)\b'
+    # Only as calls, since user and sleep are also plausible table and column names
+    r'|\b(USER|SESSION_USER|SYSTEM_USER|SLEEP)\s*\(',
+    re.IGNORECASE
+)
+
+def referenced_tables(sql_query, tables):
+    """Names from tables that appear as identifiers in the query"""
+    tokens = {token.lower() for token in re.findall(r'\w+', sql_query)}
+    return sorted(table for table in tables if table.lower() in tokens)
+
+def cache_scope(cache_namespace, confidential_mode):
+    """Cache namespace per mode: SQL written without the confidentiality prompt must not reach confidential users"""
+    return f"{cache_namespace}|confidential" if confidential_mode else cache_namespace
+
+def normalize_sql(sql_query):
+    """Collapse whitespace outside string literals and drop the trailing semicolon"""
+    parts = re.split(r"('(?:[^'\\]|\\.|'')*')", sql_query.strip().rstrip(';'))
+    return "".join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts)).strip()
+
+# Start of a query: a CTE (WITH name AS ( ...) or a plain SELECT
+SQL_START_RE = re.compile(
+    r'\bWITH\s+(?:RECURSIVE\s+)?`?\w+`?\s*(?:\([^)]*\)\s*)?AS\s*\(|\bSELECT\b', re.IGNORECASE
+)
+
+def statement_end(sql_text):
+    """Index of the first semicolon outside string literals and comments, -1 if none"""
+    quote = None
+    i = 0
+    while i < len(sql_text):
+        char = sql_text[i]
+        if quote:
+            if char == '\\' and quote != '`':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif sql_text.startswith('-- ', i) or char == '#':
+            newline = sql_text.find('\n', i)
+            i = len(sql_text) if newline < 0 else newline
+        elif sql_text.startswith('/*', i):
+            close = sql_text.find('*/', i + 2)
+            i = len(sql_text) if close < 0 else close + 1
+        elif char == ';':
+            return i
+        i += 1
+    return -1
+
+def sql_statement_complete(text):
+    """Whether (streamed) response text already holds a whole SQL statement"""
+    match = SQL_START_RE.search(text)
+    if not match:
+        return False
+    
+    rest = text[match.start():]
+    return '```' in rest or statement_end(rest) >= 0
+
+def json_reply_complete(text):
+    """Whether a streamed structured-output reply is a whole JSON object yet"""
+    text = text.strip()
+    if not text.endswith('}'):
+        return False
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+# End free-text generation right after the statement or its closing code fence
+SQL_STOP_SEQUENCES = [";\n", "\n```\n"]
+
+# Words that usually mean another clause, join or aggregate in the SQL
+COMPLEXITY_HINTS = re.compile(
+    r'\b(by|per|each|and|with|without|top|trend|compare|versus|vs|percent\w*|average|total|rank\w*|'
+    r'between|over|month\w*|year\w*|never|both|ratio|growth|breakdown|distribution)\b',
+    re.IGNORECASE
+)
+
+def question_complexity(question):
+    """0 (simple lookup) to 3 (several joins/aggregates), for sizing the output budget"""
+    hints = len(COMPLEXITY_HINTS.findall(question))
+    return min(3, hints // 2 + (len(question.split()) > 15))
+
+# Shape of the reply requested in structured-output mode
+SQL_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "sql": {"type": "STRING", "description": "One MySQL SELECT statement (a WITH clause is allowed)"},
+        "tables_used": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "is_aggregate": {"type": "BOOLEAN"},
+        "expected_row_bound": {"type": "INTEGER", "description": "Upper bound on the rows returned"}
+    },
+    "required": ["sql", "tables_used", "is_aggregate"]
+}
+
+class QuietUI:
+    """Stand-in for the st status calls used by GeminiNL2SQL when running headless"""
+    
+    def info(self, *args, **kwargs):
+        pass
+    
+    warning = error = code = info
+    
+    def spinner(self, *args, **kwargs):
+        return contextlib.nullcontext()
+    
+    def empty(self):
+        return self
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+
 class GeminiNL2SQL:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_backend=None, quiet=False, base_url=None):
         self.api_key = api_key
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-        self.cache_dir = Path("gemini_cache")
-        self.cache_dir.mkdir(exist_ok=True)
+        # Background and headless callers must not touch the Streamlit page
+        self.ui = QuietUI() if quiet else st
+        # GEMINI_BASE_URL points the app at another endpoint, e.g. mock_gemini.py
+        self.base_url = base_url or os.getenv("GEMINI_BASE_URL") or GEMINI_BASE_URL
+        # Pooled keep-alive connections, retries and rate limiting, shared per key
+        self.client = get_gemini_client(api_key, self.base_url)
+        # Any object with get/set/delete/purge_expired, see cache.py
+        self.cache_backend = cache_backend or get_cache_backend()
+        self.cache_policy = DEFAULT_CACHE_POLICY
+        self.memory_cache = response_memory_cache
+        self.failed_requests = failed_request_cache
+        self.stats = cache_stats
+        # Keep Gemini's full reply next to the extracted SQL, mainly for debugging
+        self.cache_raw_responses = False
+        # Use streamGenerateContent and stop reading once the statement is complete
+        self.streaming = False
+        # Send a duplicate request when the first is slower than the recent p95
+        self.hedging = False
+        # Keep the schema prompt server-side as a Gemini cached context, per schema
+        self.context_caching = True
+        # A cassette.Cassette records Gemini replies, or replays them without calling the API
+        self.cassette = None
+        # Ask for JSON matching SQL_RESPONSE_SCHEMA instead of parsing SQL out of prose
+        self.structured_output = True
+        # Answer simple questions from compiled local rules when they are confident enough
+        self.local_fast_path = True
+        self.fast_path_confidence = 0.85
+        self.circuit_breaker = gemini_circuit_breaker
+        self.single_flight = gemini_single_flight
     
-    def get_cache_key(self, question, schema_info):
+    def get_cache_key(self, question, schema_fingerprint):
         """Generate unique cache key"""
-        content = f"{question}_{schema_info}"
+        content = f"{question}_{schema_fingerprint}"
+        return hashlib.md5(content.encode()).hexdigest()
+    
+    @staticmethod
+    def tables_fingerprint(tables, table_fingerprints, cache_namespace=""):
+        """Combined fingerprint of a set of tables, None if one no longer exists"""
+        if any(table not in table_fingerprints for table in tables):
+            return None
+        content = "|".join([cache_namespace] + [f"{t}:{table_fingerprints[t]}" for t in sorted(tables)])
         return hashlib.md5(content.encode()).hexdigest()
     
-    def get_cached_response(self, question, schema_info):
+    def context_fingerprint(self, schema_info, table_fingerprints=None, scope=""):
+        """Key of the cached context for a schema in one confidentiality scope"""
+        if table_fingerprints is None:
+            return hashlib.md5((scope + schema_info).encode()).hexdigest()
+        return self.tables_fingerprint(table_fingerprints, table_fingerprints, scope)
+    
+    @staticmethod
+    def tables_used(sql_query, table_fingerprints):
+        """Tables referenced by a query (over-inclusive is safe, it only invalidates more)"""
+        return referenced_tables(sql_query, table_fingerprints)
+    
+    def lookup_fingerprint(self, question, schema_info, table_fingerprints=None, cache_namespace=""):
+        """Fingerprint to look a question up under, None if nothing usable is cached"""
+        if table_fingerprints is None:
+            return hashlib.md5((cache_namespace + schema_info).encode()).hexdigest()
+        
+        # The tables an earlier answer touched; only changes to those invalidate it
+        tables = self.get_cached_response(f"tables:{question}", cache_namespace, track=False)
+        if tables is None:
+            return None
+        return self.tables_fingerprint(json.loads(tables), table_fingerprints, cache_namespace)
+    
+    def store_fingerprint(self, question, sql_query, schema_info, table_fingerprints=None, cache_namespace="",
+                          reported_tables=()):
+        """Record the tables an answer touches and return the fingerprint to cache it under
+        
+        reported_tables (tables_used from a structured reply) are added to those found in the SQL.
+        """
+        if table_fingerprints is None:
+            return hashlib.md5((cache_namespace + schema_info).encode()).hexdigest()
+        
+        by_name = {table.lower(): table for table in table_fingerprints}
+        tables = set(self.tables_used(sql_query, table_fingerprints))
+        tables.update(by_name[t.lower()] for t in reported_tables if t.lower() in by_name)
+        tables = sorted(tables)
+        self.cache_response(f"tables:{question}", cache_namespace, json.dumps(tables), track=False)
+        return self.tables_fingerprint(tables, table_fingerprints, cache_namespace)
+    
+    def get_cached_entry(self, question, schema_fingerprint, track=True):
+        """Get the cached CacheEntry for a question, fresh or stale"""
+        cache_key = self.get_cache_key(question, schema_fingerprint)
+        
+        # In-process LRU first, disk only on a miss
+        entry = self.memory_cache.get(cache_key)
+        if entry is not None:
+            if track:
+                self.stats.record_hit('memory', time.time() - entry.created_at)
+            return entry
+        
+        entry = self.cache_backend.get(cache_key)
+        if entry is not None:
+            if track:
+                self.stats.record_hit('disk', time.time() - entry.created_at)
+            memory_expires_at = min(entry.expires_at, time.time() + self.cache_policy.memory_ttl)
+            self.memory_cache.set(cache_key, entry.value, entry.created_at, memory_expires_at)
+            return entry
+        return None
+    
+    def get_cached_response(self, question, schema_fingerprint, track=True):
         """Get cached Gemini response"""
-        cache_key = self.get_cache_key(question, schema_info)
-        cache_file = self.cache_dir / f"{cache_key}.json"
-        
-        if cache_file.exists():
-            with open(cache_file, 'r') as f:
-                data = json.load(f)
-                cache_time = datetime.fromisoformat(data['timestamp'])
-                if (datetime.now() - cache_time).total_seconds() < 3600:
-                    return data['response']
+        entry = self.get_cached_entry(question, schema_fingerprint, track)
+        return entry.value if entry is not None else None
+    
+    def cache_response(self, question, schema_fingerprint, response, track=True):
+        """Cache Gemini response; track=False counts bookkeeping entries apart from answers"""
+        cache_key = self.get_cache_key(question, schema_fingerprint)
+        created_at = time.time()
+        
+        self.cache_backend.set(cache_key, response, created_at, created_at + self.cache_policy.max_age)
+        self.memory_cache.set(cache_key, response, created_at, created_at + self.cache_policy.memory_ttl)
+        if track:
+            self.stats.record_write(value_size(response))
+        else:
+            self.stats.increment('route_writes')
+    
+    def is_stale(self, entry):
+        """Past fresh_ttl: still served, but due for a background refresh"""
+        return time.time() - entry.created_at >= self.cache_policy.fresh_ttl
+    
+    def get_cached_sql(self, question, schema_fingerprint):
+        """Get cached SQL for a question as a CacheEntry, decoded from its binary entry"""
+        entry = self.get_cached_entry(question, schema_fingerprint)
+        if entry is None:
+            return None
+        
+        decoded = decode_entry(entry.value)
+        sql_query = decoded['sql']
+        if not sql_query and decoded['raw']:
+            # Entries written before SQL was stored extracted
+            sql_query = self.extract_sql_from_response(decoded['raw'])
+        return CacheEntry(sql_query, entry.created_at, entry.expires_at) if sql_query else None
+    
+    def cache_sql(self, question, schema_fingerprint, sql_query, raw_response=None):
+        """Cache extracted SQL; replies that did not yield a SELECT are not cached"""
+        if not sql_query.upper().startswith(('SELECT', 'WITH')):
+            return
+        raw = raw_response if self.cache_raw_responses else None
+        self.cache_response(question, schema_fingerprint, encode_entry(sql_query, schema_fingerprint, raw))
+    
+    def get_cached_sql_template(self, template_question, literals, schema_fingerprint):
+        """Get cached SQL for a parameterized question, bound to new literals"""
+        entry = self.get_cached_sql(f"template:{template_question}", schema_fingerprint)
+        if entry:
+            return entry._replace(value=QuestionTemplater.bind(entry.value, literals))
         return None
     
-    def cache_response(self, question, schema_info, response):
-        """Cache Gemini response"""
-        cache_key = self.get_cache_key(question, schema_info)
-        cache_file = self.cache_dir / f"{cache_key}.json"
+    def cache_sql_template(self, template_question, literals, schema_fingerprint, sql_query, templater):
+        """Cache SQL with its literals replaced by placeholders, if unambiguous"""
+        sql_template = templater.to_sql_template(sql_query, literals)
+        if sql_template:
+            self.cache_sql(f"template:{template_question}", schema_fingerprint, sql_template)
+    
+    def revalidate_in_background(self, question, schema_info, confidential_mode, templater,
+                                 table_fingerprints, cache_namespace, schema_index=None, intent_engine=None):
+        """Regenerate a stale answer off the request path; the stale SQL is served meanwhile"""
+        agent = GeminiNL2SQL(self.api_key, self.cache_backend, quiet=True, base_url=self.base_url)
+        # Same request settings as the caller, so the refresh asks Gemini the same way
+        for setting in ('cache_policy', 'cache_raw_responses', 'streaming', 'hedging', 'context_caching',
+                        'cassette', 'structured_output', 'local_fast_path', 'fast_path_confidence'):
+            setattr(agent, setting, getattr(self, setting))
         
-        cache_data = {
-            'question': question,
-            'schema_info': schema_info,
-            'response': response,
-            'timestamp': datetime.now().isoformat()
-        }
+        def refresh():
+            agent.generate_sql_with_gemini(
+                question, schema_info, confidential_mode, templater,
+                table_fingerprints, cache_namespace, refresh=True, schema_index=schema_index,
+                intent_engine=intent_engine
+            )
         
-        with open(cache_file, 'w') as f:
-            json.dump(cache_data, f)
+        refresh_key = self.get_cache_key(f"refresh:{confidential_mode}:{question}", cache_namespace or schema_info)
+        if background_refresher.submit(refresh_key, refresh):
+            self.stats.increment('revalidations')
     
-    def generate_sql_with_gemini(self, question, schema_info, confidential_mode=False):
-        """Generate SQL using Gemini API"""
+    def generate_sql_with_gemini(self, question, schema_info, confidential_mode=False, templater=None,
+                                 table_fingerprints=None, cache_namespace="", refresh=False, schema_index=None,
+                                 intent_engine=None):
+        """Generate SQL using Gemini API; refresh=True skips the cache lookup
+        
+        With a SchemaIndex only the tables relevant to the question go into the prompt.
+        Questions an IntentEngine answers confidently never reach Gemini.
+        """
         try:
+            # Every cache key below (answers, templates, table routes) is per confidentiality mode
+            scope = cache_scope(cache_namespace, confidential_mode)
+            
+            # Simple questions: one compiled regex pass instead of a round trip
+            if self.local_fast_path and not refresh:
+                intent = (intent_engine or default_intent_engine).match(
+                    question, confidential_mode, self.fast_path_confidence
+                )
+                if intent:
+                    self.ui.info(f"⚡ Answered locally ({intent.confidence:.0%} confident)")
+                    self.stats.record_local_answer()
+                    return intent.sql
+            
+            templater = templater or QuestionTemplater()
+            template_question, literals = templater.parameterize(question)
+            
             # Check cache first
-            cached_response = self.get_cached_response(question, schema_info)
-            if cached_response:
-                st.info("📦 Using cached response")
-                return self.extract_sql_from_response(cached_response)
-            
-            # Build the prompt with confidentiality settings
-            prompt = self.build_sql_prompt(question, schema_info, confidential_mode)
-            
-            # Prepare API request
-            headers = {
-                'Content-Type': 'application/json',
-                'X-goog-api-key': self.api_key
-            }
+            cached = None
+            if not refresh:
+                fingerprint = self.lookup_fingerprint(question, schema_info, table_fingerprints, scope)
+                cached = self.get_cached_sql(question, fingerprint) if fingerprint else None
+                if cached:
+                    self.ui.info("📦 Using cached response")
             
-            data = {
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.1,
-                    "maxOutputTokens": 1000,
-                }
-            }
+            # Questions differing only by literal values share one SQL template
+            if not refresh and not cached and literals:
+                template_fingerprint = self.lookup_fingerprint(
+                    f"template:{template_question}", schema_info, table_fingerprints, scope
+                )
+                if template_fingerprint:
+                    cached = self.get_cached_sql_template(template_question, literals, template_fingerprint)
+                if cached:
+                    self.ui.info("📦 Using cached SQL template")
+            
+            if cached:
+                # Stale-while-revalidate: answer now, refresh in the background (replays never reach the API)
+                if self.is_stale(cached) and not (self.cassette and self.cassette.replaying):
+                    self.stats.increment('stale_hits')
+                    self.revalidate_in_background(
+                        question, schema_info, confidential_mode, templater,
+                        table_fingerprints, cache_namespace, schema_index, intent_engine
+                    )
+                return cached.value
+            
+            if not refresh:
+                self.stats.record_miss()
+            
+            # Skip the API while it is failing instead of waiting for the timeout
+            failure_key = self.get_cache_key(
+                f"failed:{question}", cache_namespace or hashlib.md5(schema_info.encode()).hexdigest()
+            )
+            if self.failed_requests.get(failure_key) is not None:
+                self.ui.warning("⚡ This question recently failed on Gemini, using local fallback")
+                return self.fallback_sql_generation(question, confidential_mode, intent_engine)
+            if not self.circuit_breaker.allow_request():
+                self.ui.warning("⚡ Gemini is temporarily unavailable, using local fallback")
+                return self.fallback_sql_generation(question, confidential_mode, intent_engine)
+            
+            # Literal categories (country, status...) point at the columns a question filters on
+            if schema_index is not None:
+                prompt_schema = schema_index.prune(
+                    question, [category for category, _ in literals if category not in ('str', 'num')]
+                )
+            else:
+                prompt_schema = schema_info
             
-            # Make API request
-            with st.spinner("🤔 Gemini is generating SQL query..."):
-                response = requests.post(
-                    self.base_url,
-                    headers=headers,
-                    json=data,
-                    timeout=30
+            # Rules, examples and the full schema are sent once as a cached context when possible
+            # Not with a cassette: recordings must hold whole prompts to replay without the API
+            use_context_cache = self.context_caching and self.cassette is None
+            cached_context = None
+            if use_context_cache:
+                context_key = self.context_fingerprint(schema_info, table_fingerprints, scope)
+                # The prefix is only built when a context has to be created
+                cached_context = self.client.context_cache.get(
+                    context_key, lambda: self.build_prompt_prefix(schema_info, confidential_mode)
+                )
+            # Output budget sized from similar questions, so verbose replies stop early
+            complexity = question_complexity(question)
+            output_budget = self.client.output_budget
+            max_output_tokens = output_budget.budget(complexity)
+            if cached_context:
+                data = self.build_generate_request(
+                    self.build_question_prompt(question), cached_context, max_output_tokens
+                )
+            else:
+                # Build the prompt with confidentiality settings
+                data = self.build_generate_request(
+                    self.build_sql_prompt(question, prompt_schema, confidential_mode),
+                    max_output_tokens=max_output_tokens
                 )
+            
+            # Make API request; identical concurrent requests share one call
+            with self.ui.spinner("🤔 Gemini is generating SQL query..."):
+                if self.streaming and self.structured_output:
+                    preview = self.ui.empty()
+                    
+                    def request():
+                        return self.stream_from_gemini(
+                            data, failure_key,
+                            on_text=lambda text: preview.code(text, language="json"),
+                            is_complete=json_reply_complete
+                        )
+                elif self.streaming:
+                    preview = self.ui.empty()
+                    
+                    def request():
+                        return self.stream_from_gemini(
+                            data, failure_key,
+                            on_text=lambda text: preview.code(re.sub(r'```sql|```', '', text).strip(), language="sql")
+                        )
+                else:
+                    def request():
+                        return self.post_to_gemini(data, failure_key)
+                
+                flight_key = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+                (response, result), leader = self.single_flight.do(flight_key, request)
+                
+                if cached_context and response.status_code in (400, 403, 404):
+                    # The context expired or was deleted upstream; resend with the whole prompt
+                    self.client.context_cache.invalidate(context_key)
+                    self.failed_requests.delete(failure_key)
+                    data = self.build_generate_request(
+                        self.build_sql_prompt(question, prompt_schema, confidential_mode),
+                        max_output_tokens=max_output_tokens
+                    )
+                    flight_key = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+                    (response, result), leader = self.single_flight.do(flight_key, request)
+                
+                if self.is_truncated(result) and max_output_tokens < output_budget.maximum:
+                    if leader:
+                        output_budget.observe(complexity, None, truncated=True)
+                    # Cut off mid-answer: resend once with the largest budget
+                    data["generationConfig"] = dict(data["generationConfig"], maxOutputTokens=output_budget.maximum)
+                    flight_key = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+                    (response, result), leader = self.single_flight.do(flight_key, request)
                 
                 if response.status_code == 200:
-                    result = response.json()
-                    if 'candidates' in result and len(result['candidates']) > 0:
+                    if result and 'candidates' in result and len(result['candidates']) > 0:
                         sql_response = result['candidates'][0]['content']['parts'][0]['text']
                         
-                        # Cache the response
-                        self.cache_response(question, schema_info, sql_response)
+                        # Structured replies carry the SQL in a JSON field; anything else goes through the regex path
+                        reply = self.parse_structured_response(sql_response) if self.structured_output else None
+                        sql_query = self.extract_sql_from_response(reply['sql'] if reply else sql_response)
+                        tables_used = reply.get('tables_used') if reply else None
+                        reported_tables = [str(t) for t in tables_used] if isinstance(tables_used, list) else []
+                        if table_fingerprints and reported_tables:
+                            known = {table.lower() for table in table_fingerprints}
+                            unknown = [t for t in reported_tables if t.lower() not in known]
+                            if unknown:
+                                self.ui.warning(f"⚠️ Generated SQL refers to unknown tables: {', '.join(unknown)}")
+                        
+                        # Waiting callers got the same reply; the leader already cached it
+                        if not leader:
+                            return sql_query
+                        
+                        output_budget.observe(complexity, self.reply_tokens(result), self.is_truncated(result))
+                        
+                        # Cache the response under the tables it touches
+                        fingerprint = self.store_fingerprint(
+                            question, sql_query, schema_info, table_fingerprints, scope, reported_tables
+                        )
+                        self.cache_sql(question, fingerprint, sql_query, sql_response)
                         
-                        return self.extract_sql_from_response(sql_response)
+                        if literals:
+                            template_fingerprint = self.store_fingerprint(
+                                f"template:{template_question}", sql_query, schema_info,
+                                table_fingerprints, scope, reported_tables
+                            )
+                            self.cache_sql_template(
+                                template_question, literals, template_fingerprint, sql_query, templater
+                            )
+                        return sql_query
                     else:
-                        st.error("No response from Gemini API")
-                        return self.fallback_sql_generation(question, confidential_mode)
+                        self.ui.error("No response from Gemini API")
+                        return self.fallback_sql_generation(question, confidential_mode, intent_engine)
                 else:
-                    st.error(f"Gemini API error: {response.status_code} - {response.text}")
-                    return self.fallback_sql_generation(question, confidential_mode)
+                    self.ui.error(f"Gemini API error: {response.status_code} - {response.text}")
+                    return self.fallback_sql_generation(question, confidential_mode, intent_engine)
             
         except Exception as e:
-            st.error(f"Gemini query failed: {str(e)}")
-            return self.fallback_sql_generation(question, confidential_mode)
+            self.ui.error(f"Gemini query failed: {str(e)}")
+            return self.fallback_sql_generation(question, confidential_mode, intent_engine)
+    
+    def build_generate_request(self, prompt, cached_content=None, max_output_tokens=1000):
+        """generateContent request body, continuing a cached context if given"""
+        data = {
+            "contents": [
+                {
+                    "role": "user",
+                    "parts": [
+                        {
+                            "text": prompt
+                        }
+                    ]
+                }
+            ],
+            "generationConfig": {
+                "temperature": 0.1,
+                "maxOutputTokens": max_output_tokens,
+            }
+        }
+        if self.structured_output:
+            data["generationConfig"]["responseMimeType"] = "application/json"
+            data["generationConfig"]["responseSchema"] = SQL_RESPONSE_SCHEMA
+        else:
+            data["generationConfig"]["stopSequences"] = SQL_STOP_SEQUENCES
+        if cached_content:
+            data["cachedContent"] = cached_content
+        return data
+    
+    @staticmethod
+    def is_truncated(result):
+        """Whether a reply stopped because it ran out of output tokens"""
+        candidates = (result or {}).get('candidates') or []
+        return bool(candidates) and candidates[0].get('finishReason') == 'MAX_TOKENS'
+    
+    @staticmethod
+    def reply_tokens(result):
+        """Output tokens of a reply, estimated from its text when usage is not reported"""
+        usage = result.get('usageMetadata') or {}
+        if usage.get('candidatesTokenCount'):
+            return usage['candidatesTokenCount']
+        return len(result['candidates'][0]['content']['parts'][0]['text']) // 4 + 1
+    
+    def post_to_gemini(self, data, failure_key):
+        """POST a generateContent request and record the outcome for the circuit breaker"""
+        if self.cassette and self.cassette.replaying:
+            return self.cassette.replay(data)
+        
+        start = time.monotonic()
+        try:
+            response = self.client.generate_content(data, hedge=self.hedging)
+        except requests.RequestException:
+            self.record_gemini_failure(failure_key, time.monotonic() - start)
+            raise
+        latency = time.monotonic() - start
+        
+        result = response.json() if response.status_code == 200 else None
+        if self.cassette:
+            self.cassette.record(data, response.status_code, result if result is not None else response.text, latency)
+        if result and result.get('candidates'):
+            self.circuit_breaker.record_success(latency)
+            self.stats.record_upstream_latency(latency)
+        else:
+            self.record_gemini_failure(failure_key, latency)
+        return response, result
+    
+    def stream_from_gemini(self, data, failure_key, on_text=None, is_complete=sql_statement_complete):
+        """Stream a reply, stopping as soon as is_complete(text) says the answer has arrived
+        
+        Returns the same (response, result) shape as post_to_gemini.
+        """
+        if self.cassette and self.cassette.replaying:
+            response, result = self.cassette.replay(data)
+            if on_text and result:
+                on_text(result['candidates'][0]['content']['parts'][0]['text'])
+            return response, result
+        
+        start = time.monotonic()
+        try:
+            response = self.client.stream_generate_content(data)
+        except requests.RequestException:
+            self.record_gemini_failure(failure_key, time.monotonic() - start)
+            raise
+        
+        if response.status_code != 200:
+            self.record_gemini_failure(failure_key, time.monotonic() - start)
+            if self.cassette:
+                self.cassette.record(data, response.status_code, response.text, time.monotonic() - start)
+            return response, None
+        
+        text = ""
+        try:
+            for chunk in iter_sse_text(response):
+                text += chunk
+                if on_text:
+                    on_text(text)
+                # Anything after the statement is explanation we would discard anyway
+                if is_complete(text):
+                    break
+        except (requests.RequestException, ValueError):
+            self.record_gemini_failure(failure_key, time.monotonic() - start)
+            raise
+        finally:
+            response.close()
+        latency = time.monotonic() - start
+        
+        if not text:
+            self.record_gemini_failure(failure_key, latency)
+            return response, None
+        
+        result = {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+        if self.cassette:
+            self.cassette.record(data, 200, result, latency)
+        self.circuit_breaker.record_success(latency)
+        self.stats.record_upstream_latency(latency)
+        return response, result
+    
+    def record_gemini_failure(self, failure_key, latency):
+        """Count a failed call against the breaker and negatively cache the question"""
+        self.circuit_breaker.record_failure(latency)
+        self.failed_requests.set(failure_key, True)
     
     def build_sql_prompt(self, question, schema_info, confidential_mode=False):
         """Build optimized prompt for SQL generation"""
+        return self.build_prompt_prefix(schema_info, confidential_mode) + self.build_question_prompt(question)
+    
+    def build_prompt_prefix(self, schema_info, confidential_mode=False):
+        """Question-independent part of the prompt, the same for every question on a schema"""
         confidentiality_note = ""
         if confidential_mode:
             confidentiality_note = """
@@ -226,8 +745,6 @@ You are an expert SQL query generator for MySQL. Given this database schema and
 DATABASE SCHEMA:
 {schema_info}
 
-QUESTION: {question}
-
 {confidentiality_note}
 
 RULES:
@@ -255,75 +772,81 @@ SQL: SELECT COUNT(*) as customer_count FROM customers WHERE country = 'France'
 
 Question: "Top 5 products by profit margin"
 SQL: SELECT productName, (MSRP - buyPrice) as profit_margin FROM products ORDER BY profit_margin DESC LIMIT 5
-
+"""
+    
+    def build_question_prompt(self, question):
+        return f"""
 Now generate the SQL for: {question}
 """
     
+    def parse_structured_response(self, response):
+        """The JSON object of a structured-output reply, None if the reply is not one"""
+        try:
+            reply = json.loads(response)
+        except ValueError:
+            # Some replies still wrap the object in a code fence
+            match = re.search(r'\{.*\}', response, re.DOTALL)
+            if not match:
+                return None
+            try:
+                reply = json.loads(match.group(0))
+            except ValueError:
+                return None
+        
+        if not isinstance(reply, dict) or not isinstance(reply.get('sql'), str) or not reply['sql'].strip():
+            return None
+        return reply
+    
     def extract_sql_from_response(self, response):
         """Extract SQL query from Gemini response"""
         # Clean the response
         response = re.sub(r'```sql|```', '', response)
         
-        # Find SQL query
-        sql_match = re.search(r'(SELECT\s+.*?)(?=;|$)', response, re.IGNORECASE | re.DOTALL)
+        # Find the query (SELECT or WITH ...), up to the first semicolon outside strings and comments
+        sql_match = SQL_START_RE.search(response)
         if sql_match:
-            sql_query = sql_match.group(1).strip()
-            if not sql_query.endswith(';'):
-                sql_query += ';'
-            return sql_query
+            sql_query = response[sql_match.start():]
+            end = statement_end(sql_query)
+            if end >= 0:
+                sql_query = sql_query[:end]
+            return sql_query.strip() + ';'
         
         return response.strip()
     
-    def fallback_sql_generation(self, question, confidential_mode=False):
+    def fallback_sql_generation(self, question, confidential_mode=False, intent_engine=None):
         """Enhanced fallback SQL generation"""
-        question_lower = question.lower()
-        
-        # Confidential mode adjustments
-        confidential_select = "customerName, country, creditLimit" if confidential_mode else "*"
-        
-        rules = [
-            (r'how many.*employee', "SELECT COUNT(*) as total_employees FROM employees"),
-            (r'count.*customer', "SELECT COUNT(*) as total_customers FROM customers"),
-            (r'list.*customer.*(\w+)', f"SELECT {confidential_select} FROM customers WHERE country = '{{}}' LIMIT 50"),
-            (r'customer.*from.*(\w+)', f"SELECT {confidential_select} FROM customers WHERE country = '{{}}' LIMIT 50"),
-            (r'product.*stock.*less than (\d+)', "SELECT productName, quantityInStock FROM products WHERE quantityInStock < {}"),
-            (r'low.*stock', "SELECT productName, quantityInStock FROM products WHERE quantityInStock < 100 ORDER BY quantityInStock"),
-            (r'top.*product.*price', "SELECT productName, buyPrice FROM products ORDER BY buyPrice DESC LIMIT 10"),
-            (r'customer.*credit.*high', "SELECT customerName, creditLimit FROM customers ORDER BY creditLimit DESC LIMIT 10"),
-            (r'order.*status.*(\w+)', "SELECT orderNumber, orderDate, status FROM orders WHERE status = '{}'"),
-            (r'employee.*office', "SELECT e.firstName, e.lastName, e.jobTitle, o.city FROM employees e JOIN offices o ON e.officeCode = o.officeCode"),
-        ]
-        
-        for pattern, template in rules:
-            match = re.search(pattern, question_lower)
-            if match:
-                if '{}' in template:
-                    groups = match.groups()
-                    if groups:
-                        country_map = {'france': 'France', 'usa': 'USA', 'french': 'France', 'us': 'USA'}
-                        value = country_map.get(groups[0].lower(), groups[0].title())
-                        return template.format(value)
-                return template
-        
-        # Default fallbacks with confidential mode
-        if any(word in question_lower for word in ['employee', 'staff']):
-            select_cols = "employeeNumber, firstName, lastName, jobTitle, officeCode" if confidential_mode else "*"
-            return f"SELECT {select_cols} FROM employees LIMIT 20"
-        elif any(word in question_lower for word in ['customer', 'client']):
-            select_cols = "customerName, country, creditLimit" if confidential_mode else "*"
-            return f"SELECT {select_cols} FROM customers LIMIT 20"
-        elif any(word in question_lower for word in ['product']):
-            return "SELECT productName, productLine, quantityInStock FROM products LIMIT 20"
-        elif any(word in question_lower for word in ['order']):
-            return "SELECT orderNumber, orderDate, status FROM orders LIMIT 20"
-        else:
-            return "SELECT COUNT(*) as count FROM employees"
+        # Gemini is out of the picture, so the best local rule wins at any confidence
+        intent = (intent_engine or default_intent_engine).match(question, confidential_mode)
+        if intent:
+            return intent.sql
+        
+        # The question names no table of this database
+        return "SELECT 'No local answer for this question, try rephrasing it' AS message"
 
 class DatabaseManager:
     def __init__(self):
         self.engine = None
         self.schema_info = ""
         self.tables_info = {}
+        self.foreign_keys = []
+        self.schema_index = None
+        # Above this many estimated tokens the prompt only gets the tables a question needs
+        self.schema_token_budget = 1500
+        self.literal_values = {}
+        self.question_templater = QuestionTemplater()
+        self.intent_engine = None
+        self.table_fingerprints = {}
+        self.schema_fingerprint = ""
+        self.cache_namespace = ""
+        # None turns result caching off, e.g. for reproducible benchmark runs
+        self.result_cache = get_result_cache()
+        self.result_cache_scope = ""
+        # Seconds a table's data version is trusted before information_schema is asked again
+        self.data_version_ttl = 2
+        self._data_versions = {}
+        # CHECKSUM TABLE scans the whole table, so its result is reused this long while the cheap signals hold
+        self.checksum_ttl = 300
+        self._checksums = {}
         
     def connect(self, host, user, password, database, port=3306):
         """Connect to MySQL database"""
@@ -334,7 +857,13 @@ class DatabaseManager:
             with self.engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
             
+            self.cache_namespace = f"{host}:{port}/{database}"
+            # Users may have different grants, so results are not shared between them
+            self.result_cache_scope = f"{user}@{self.cache_namespace}"
+            self._data_versions = {}
+            self._checksums = {}
             self.extract_schema_info()
+            self.extract_literal_values()
             return True
         except Exception as e:
             st.error(f"Database connection failed: {str(e)}")
@@ -342,8 +871,11 @@ class DatabaseManager:
     
     def extract_schema_info(self):
         """Extract detailed schema information"""
+        # A reconnect may point at another database, or tables may have been dropped
+        self.tables_info = {}
+        self.foreign_keys = []
         try:
-            schema_parts = []
+            schema_parts = {}
             
             with self.engine.connect() as conn:
                 # Get table information
@@ -374,29 +906,211 @@ class DatabaseManager:
                             col_str += " 🔗"
                         col_display.append(col_str)
                     
-                    schema_parts.append(f"TABLE: {table}\nCOLUMNS: {', '.join(col_display)}")
+                    schema_parts[table] = f"TABLE: {table}\nCOLUMNS: {', '.join(col_display)}"
+                
+                # Declared foreign keys, for join paths between the tables a question needs
+                self.foreign_keys = [
+                    tuple(row) for row in conn.execute(text(
+                        "SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+                        "FROM information_schema.KEY_COLUMN_USAGE "
+                        "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL"
+                    ))
+                ]
             
-            self.schema_info = "\n\n".join(schema_parts)
+            self.schema_info = "\n\n".join(schema_parts.values())
+            self.schema_index = SchemaIndex(
+                schema_parts, self.tables_info, self.foreign_keys, token_budget=self.schema_token_budget
+            )
+            self.compute_schema_fingerprints()
             
         except Exception as e:
             st.error(f"Schema extraction failed: {str(e)}")
     
+    def compute_schema_fingerprints(self):
+        """Stable per-table and whole-schema fingerprints from tables_info"""
+        self.table_fingerprints = {
+            table: hashlib.md5(json.dumps(columns, sort_keys=True, default=str).encode()).hexdigest()
+            for table, columns in self.tables_info.items()
+        }
+        content = "|".join(f"{t}:{fp}" for t, fp in sorted(self.table_fingerprints.items()))
+        self.schema_fingerprint = hashlib.md5(content.encode()).hexdigest()
+    
+    def extract_literal_values(self, max_values=200):
+        """Collect categorical values (countries, statuses...) users mention in questions"""
+        literal_values = {}
+        
+        def add(value, category):
+            if not isinstance(value, str) or len(value) < 2 or value.replace('.', '').isdigit():
+                return
+            key = value.lower()
+            if key in literal_values and literal_values[key][1] != category:
+                # Same value in several columns, e.g. a city that is also a state
+                categories = set(literal_values[key][1].split('|')) | {category}
+                category = '|'.join(sorted(categories))
+            literal_values[key] = (value, category)
+        
+        failures = []
+        try:
+            with self.engine.connect() as conn:
+                for table, columns in self.tables_info.items():
+                    for col in columns:
+                        col_type = str(col['type']).lower()
+                        category = col['name'].lower()
+                        
+                        if col_type.startswith('enum('):
+                            for value in re.findall(r"'((?:[^']|'')*)'", str(col['type'])):
+                                add(value.replace("''", "'"), category)
+                            continue
+                        
+                        if not col_type.startswith(('varchar', 'char')):
+                            continue
+                        if not any(hint in category for hint in CATEGORICAL_HINTS):
+                            continue
+                        
+                        # One unreadable column (dropped table, missing grant) must not cost all the others
+                        try:
+                            result = conn.execute(text(
+                                f"SELECT DISTINCT `{col['name']}` FROM `{table}` LIMIT {max_values + 1}"
+                            ))
+                            values = [row[0] for row in result]
+                        except Exception as e:
+                            conn.rollback()
+                            failures.append(f"{table}.{col['name']}: {e}")
+                            continue
+                        # High-cardinality columns are not categorical
+                        if len(values) <= max_values:
+                            for value in values:
+                                add(value, category)
+        except Exception as e:
+            st.error(f"Literal value extraction failed: {str(e)}")
+        if failures:
+            st.warning(f"Skipped {len(failures)} column(s) during literal value extraction: {failures[0]}")
+        
+        self.literal_values = literal_values
+        self.question_templater = QuestionTemplater(literal_values)
+        self.intent_engine = self.build_intent_engine()
+    
+    def build_intent_engine(self):
+        """Local rules derived from tables_info, compiled once per schema and sampled values"""
+        # Keyed on exactly what the rules are built from: schema_fingerprint is left over from the
+        # previous connection when extraction fails, and would hand back that database's rules
+        key = hashlib.md5(
+            json.dumps([self.tables_info, sorted(self.literal_values.items())], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        entry = intent_engine_cache.get(key)
+        if entry is not None:
+            return entry.value
+        
+        engine = IntentEngine(rules_from_schema(self.tables_info, self.literal_values), self.literal_values)
+        intent_engine_cache.set(key, engine)
+        return engine
+    
     def execute_query(self, sql_query):
         """Execute SQL query and return results"""
         try:
             if not self.validate_query_security(sql_query):
                 return "SECURITY_ERROR: Only SELECT queries are allowed"
             
+            # Identical SQL over unchanged tables is served from the result cache
+            cache_key = self.result_cache_key(sql_query)
+            if cache_key:
+                entry = self.result_cache.get(cache_key)
+                if entry is not None:
+                    return entry.value
+            
             with self.engine.connect() as conn:
                 result = conn.execute(text(sql_query))
                 columns = result.keys()
                 data = result.fetchall()
                 
-                df = pd.DataFrame(data, columns=columns)
-                return fix_dataframe_types(df)
+                df = fix_dataframe_types(pd.DataFrame(data, columns=columns))
+            
+            if cache_key:
+                self.result_cache.set(cache_key, df)
+            return df
         except Exception as e:
             return f"Query execution failed: {str(e)}"
     
+    def result_cache_key(self, sql_query):
+        """Key on normalized SQL plus the data version of each table read, None if not cacheable"""
+        if self.result_cache is None or NON_DETERMINISTIC_SQL.search(sql_query):
+            return None
+        
+        tables = referenced_tables(sql_query, self.tables_info)
+        if not tables:
+            return None
+        
+        try:
+            versions = self.get_data_versions(tables)
+        except Exception:
+            return None
+        # Views and tables without a usable version are never cached
+        if any(table not in versions for table in tables):
+            return None
+        
+        content = "|".join(
+            [self.result_cache_scope, normalize_sql(sql_query)] + [f"{t}:{versions[t]}" for t in tables]
+        )
+        return hashlib.md5(content.encode()).hexdigest()
+    
+    def get_data_versions(self, tables):
+        """Data version per table from information_schema.TABLES, CHECKSUM TABLE when UPDATE_TIME is unknown"""
+        now = time.time()
+        versions = {}
+        stale = []
+        for table in tables:
+            cached = self._data_versions.get(table)
+            if cached and now - cached[1] < self.data_version_ttl:
+                versions[table] = cached[0]
+            else:
+                stale.append(table)
+        
+        if not stale:
+            return versions
+        
+        by_name = {table.lower(): table for table in stale}
+        with self.engine.connect() as conn:
+            try:
+                # MySQL 8 otherwise serves these columns from a cache refreshed daily
+                conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+            except Exception:
+                pass
+            
+            rows = conn.execute(
+                text(
+                    "SELECT TABLE_NAME, TABLE_TYPE, UPDATE_TIME, TABLE_ROWS, DATA_LENGTH, AUTO_INCREMENT "
+                    "FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :tables"
+                ).bindparams(bindparam('tables', expanding=True)),
+                {'tables': stale}
+            ).fetchall()
+            
+            for name, table_type, update_time, table_rows, data_length, auto_increment in rows:
+                table = by_name.get(name.lower())
+                if table is None or table_type != 'BASE TABLE':
+                    continue
+                
+                signals = f"{table_rows}:{data_length}:{auto_increment}"
+                if update_time is not None:
+                    version = f"{update_time}:{signals}"
+                else:
+                    # UPDATE_TIME is NULL after a server restart until the next write (and always for
+                    # some tables), so the checksum backs up the cheap signals, refreshed only now and then
+                    previous = self._checksums.get(table)
+                    if previous and previous[0] == signals and now - previous[2] < self.checksum_ttl:
+                        checksum = previous[1]
+                    else:
+                        checksum = conn.execute(text(f"CHECKSUM TABLE `{name}`")).fetchone()[1]
+                        if checksum is None:
+                            continue
+                        self._checksums[table] = (signals, checksum, now)
+                    version = f"checksum:{checksum}:{signals}"
+                
+                versions[table] = version
+                self._data_versions[table] = (version, now)
+        
+        return versions
+    
     def validate_query_security(self, sql_query):
         """Validate query security"""
         sql_upper = sql_query.upper().strip()
@@ -406,7 +1120,7 @@ class DatabaseManager:
             if keyword in sql_upper:
                 return False
         
-        return sql_upper.startswith('SELECT')
+        return sql_upper.startswith(('SELECT', 'WITH'))
     
     def get_table_stats(self):
         """Get table statistics"""
@@ -460,6 +1174,51 @@ class DatabaseManager:
         
         return insights
 
+QUICK_QUERIES = [
+    "Count total employees by office",
+    "List top 10 customers by credit limit",
+    "Products with quantity less than 50",
+    "Orders by status this month",
+    "Employee distribution by job title",
+    "Sales performance by product line",
+    "Customer count by country",
+    "Average order value",
+    "Products never ordered",
+    "Monthly sales trend"
+]
+
+ANALYTICS_PROMPTS = {
+    "sales": "Show monthly sales trend for the last 6 months with product line breakdown",
+    "employees": "Show employee count by office location and job title with percentages",
+    "financial": "Show total payments by customer and credit limit utilization",
+    "inventory": "Show products by vendor with stock levels and reorder recommendations",
+    "geographic": "Show customer distribution by country and average credit limit",
+    "operations": "Show order fulfillment times and status distribution",
+}
+
+def start_cache_warmup(api_key, db_manager, confidential_mode=False):
+    """Pre-generate SQL for the Quick Actions and Advanced Analytics prompts in the background"""
+    agent = GeminiNL2SQL(api_key, quiet=True)
+    
+    def generate(question):
+        return agent.generate_sql_with_gemini(
+            question,
+            db_manager.schema_info,
+            confidential_mode,
+            templater=db_manager.question_templater,
+            table_fingerprints=db_manager.table_fingerprints,
+            cache_namespace=db_manager.cache_namespace,
+            schema_index=db_manager.schema_index,
+            intent_engine=db_manager.intent_engine
+        )
+    
+    return cache_warmer.ensure_warm(
+        cache_scope(db_manager.cache_namespace, confidential_mode),
+        db_manager.schema_fingerprint,
+        QUICK_QUERIES + list(ANALYTICS_PROMPTS.values()),
+        generate
+    )
+
 def save_query_history(history):
     """Save query history to file"""
     try:
@@ -515,9 +1274,30 @@ def main():
         gemini_key = st.text_input("🔑 Gemini API Key", type="password", 
                                  help="Your Gemini API key")
         
+        streaming = st.checkbox(
+            "⚡ Stream SQL generation",
+            value=st.session_state.get('streaming', False),
+            help="Show the SQL as Gemini writes it and start executing as soon as it is complete"
+        )
+        st.session_state.streaming = streaming
+        
+        hedging = st.checkbox(
+            "🏁 Hedge slow requests",
+            value=st.session_state.get('hedging', False),
+            help="Send a second request when Gemini is slower than usual and use whichever answers first"
+        )
+        st.session_state.hedging = hedging
+        
         if gemini_key:
             st.session_state.gemini_agent = GeminiNL2SQL(gemini_key)
+            st.session_state.gemini_agent.streaming = streaming
+            st.session_state.gemini_agent.hedging = hedging
             st.success("✅ Gemini 2.0 Flash Ready!")
+            client = st.session_state.gemini_agent.client
+            st.caption(
+                f"Timeout {client.adaptive_timeout():.1f}s · hedged {client.hedges}, won {client.hedge_wins} · "
+                f"truncated {client.output_budget.truncations}/{client.output_budget.requests} replies"
+            )
         
         # Database connection
         st.header("🔗 Database Connection")
@@ -534,6 +1314,10 @@ def main():
                 else:
                     st.error("❌ Connection Failed")
         
+        # Warm the cache for the canned prompts; no-op once warm for this schema
+        if gemini_key and st.session_state.db_manager.engine:
+            start_cache_warmup(gemini_key, st.session_state.db_manager, st.session_state.confidential_mode)
+        
         # Database Schema Explorer
         if st.session_state.db_manager.engine:
             st.header("📊 Database Schema")
@@ -556,6 +1340,34 @@ def main():
                         st.session_state.question = f"Show sample data from {table_name}"
                         st.rerun()
         
+        # Cache Statistics
+        st.header("📦 Cache Statistics")
+        with st.expander("Gemini cache"):
+            stats = cache_stats.snapshot()
+            hit_ratio = stats['hit_ratio']
+            st.metric("Hit Ratio", f"{hit_ratio:.0%}" if hit_ratio is not None else "—")
+            col_a, col_b = st.columns(2)
+            with col_a:
+                st.metric("Memory Hits", stats['memory_hits'])
+                st.metric("Misses", stats['misses'])
+                st.metric("Evictions", stats['memory_evictions'])
+            with col_b:
+                st.metric("Disk Hits", stats['disk_hits'])
+                st.metric("Expirations", stats['memory_expirations'] + stats['disk_expirations'])
+                st.metric("Latency Saved", f"{stats['latency_saved']:.1f}s")
+            
+            st.write(f"♻️ Stale hits: {stats['stale_hits']}, background refreshes: {stats['revalidations']}")
+            st.write(f"⚡ Answered locally without Gemini: {stats['local_answers']}")
+            st.write(f"🧠 Memory: {len(response_memory_cache)} entries, {response_memory_cache.total_bytes / 1024:.1f} KB")
+            # Scans the whole store, so only on request
+            if st.button("💾 Measure disk usage"):
+                disk_entries, disk_bytes = get_cache_backend().size_info()
+                st.write(f"💾 Disk: {disk_entries} entries, {disk_bytes / 1024:.1f} KB")
+            if stats['entry_age_p50'] is not None:
+                st.write(f"⏱️ Entry age at hit: p50 ≤ {stats['entry_age_p50']:g}s, p95 ≤ {stats['entry_age_p95']:g}s")
+            if stats['entry_size_p50'] is not None:
+                st.write(f"📏 Entry size: p50 ≤ {stats['entry_size_p50']:g} B, p95 ≤ {stats['entry_size_p95']:g} B")
+        
         # Query History
         st.header("📜 Query History")
         if st.session_state.query_history:
@@ -581,6 +1393,10 @@ def main():
         with col1:
             st.header("💬 Natural Language Query")
             
+            # Questions picked from buttons or history fill the input box
+            if 'question' in st.session_state:
+                st.session_state.question_input = st.session_state.pop('question')
+            
             question = st.text_area(
                 "Ask anything about your data:",
                 height=100,
@@ -601,7 +1417,12 @@ def main():
                 sql_query = st.session_state.gemini_agent.generate_sql_with_gemini(
                     question, 
                     st.session_state.db_manager.schema_info,
-                    st.session_state.confidential_mode
+                    st.session_state.confidential_mode,
+                    templater=st.session_state.db_manager.question_templater,
+                    table_fingerprints=st.session_state.db_manager.table_fingerprints,
+                    cache_namespace=st.session_state.db_manager.cache_namespace,
+                    schema_index=st.session_state.db_manager.schema_index,
+                    intent_engine=st.session_state.db_manager.intent_engine
                 )
                 
                 st.subheader("📋 Generated SQL")
@@ -645,20 +1466,7 @@ def main():
         with col2:
             st.header("💡 Quick Actions")
             
-            quick_queries = [
-                "Count total employees by office",
-                "List top 10 customers by credit limit",
-                "Products with quantity less than 50",
-                "Orders by status this month",
-                "Employee distribution by job title",
-                "Sales performance by product line",
-                "Customer count by country",
-                "Average order value",
-                "Products never ordered",
-                "Monthly sales trend"
-            ]
-            
-            for query in quick_queries:
+            for query in QUICK_QUERIES:
                 if st.button(query, use_container_width=True, key=f"quick_{hash(query)}"):
                     st.session_state.question = query
                     st.rerun()
@@ -670,29 +1478,29 @@ def main():
         
         with col1:
             if st.button("📈 Sales Dashboard", use_container_width=True):
-                st.session_state.question = "Show monthly sales trend for the last 6 months with product line breakdown"
+                st.session_state.question = ANALYTICS_PROMPTS["sales"]
                 st.rerun()
             
             if st.button("👥 Employee Analytics", use_container_width=True):
-                st.session_state.question = "Show employee count by office location and job title with percentages"
+                st.session_state.question = ANALYTICS_PROMPTS["employees"]
                 st.rerun()
         
         with col2:
             if st.button("💰 Financial Overview", use_container_width=True):
-                st.session_state.question = "Show total payments by customer and credit limit utilization"
+                st.session_state.question = ANALYTICS_PROMPTS["financial"]
                 st.rerun()
             
             if st.button("📦 Inventory Analysis", use_container_width=True):
-                st.session_state.question = "Show products by vendor with stock levels and reorder recommendations"
+                st.session_state.question = ANALYTICS_PROMPTS["inventory"]
                 st.rerun()
         
         with col3:
             if st.button("🌍 Geographic Analysis", use_container_width=True):
-                st.session_state.question = "Show customer distribution by country and average credit limit"
+                st.session_state.question = ANALYTICS_PROMPTS["geographic"]
                 st.rerun()
             
             if st.button("🚚 Operations Metrics", use_container_width=True):
-                st.session_state.question = "Show order fulfillment times and status distribution"
+                st.session_state.question = ANALYTICS_PROMPTS["operations"]
                 st.rerun()
     
     with tab3:
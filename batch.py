@@ -0,0 +1,188 @@
+"""Run a file of questions through the NL2SQL pipeline without the UI.
+
+    python batch.py questions.txt --output nightly/ --concurrency 16 --rate 5
+
+One question per line; blank lines and lines starting with # are
+skipped. Connection settings default to the same environment variables
+as the app (GEMINI_API_KEY, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+DB_PORT). Each question's rows go to nightly/results/<n>.<format>; SQL,
+timings, row counts and errors for all of them go to
+nightly/summary.<format>. The Gemini, SQL template and query result
+caches are the same ones the app uses, so repeated runs mostly skip
+the API; --no-cache (implied by --replay) bypasses them so every question
+goes through prompt building, Gemini or the cassette, and MySQL.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+# app.py renders its page header on import; outside `streamlit run` that only logs warnings
+logging.disable(logging.WARNING)
+from app import DatabaseManager, GeminiNL2SQL
+logging.disable(logging.NOTSET)
+from cache import NullCacheBackend
+from cassette import RECORD, REPLAY, Cassette
+from gemini_client import TokenBucket
+from pipeline import NL2SQLPipeline
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+
+def read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def write_frame(df, path, fmt):
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+async def run_batch(pipeline, questions, output_dir, fmt):
+    """Ask every question concurrently, writing each result as soon as it is ready"""
+    results_dir = output_dir / "results"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    done = 0
+
+    async def run_one(index, question):
+        nonlocal done
+        result = await pipeline.ask(question)
+        row = {
+            'index': index,
+            'question': question,
+            'sql': result.sql,
+            'generation_seconds': round(result.generation_seconds, 4),
+            'execution_seconds': round(result.execution_seconds, 4),
+            'rows': None,
+            'result_file': None,
+            'error': result.error,
+        }
+        if result.data is not None:
+            path = results_dir / f"{index:04d}.{fmt}"
+            try:
+                # Off the loop: large results take a while to serialise
+                await loop.run_in_executor(None, write_frame, result.data, path, fmt)
+                row['rows'] = len(result.data)
+                row['result_file'] = str(path.relative_to(output_dir))
+            except Exception as e:
+                row['error'] = f"Writing results failed: {e}"
+
+        done += 1
+        status = "ok" if row['error'] is None else "FAILED"
+        print(f"[{done}/{len(questions)}] {status} {question}", file=sys.stderr)
+        return row
+
+    return await asyncio.gather(*(run_one(i, q) for i, q in enumerate(questions)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run natural-language questions from a file through Gemini and MySQL")
+    parser.add_argument("questions", help="text file with one question per line")
+    parser.add_argument("--output", default="batch_output", help="directory for the summary and result files")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions generated in parallel")
+    parser.add_argument("--db-concurrency", type=int, default=4, help="queries executed in parallel (SQLAlchemy's default pool allows up to 15)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Gemini requests per second")
+    parser.add_argument("--confidential", action="store_true", help="generate SQL in confidential mode")
+    parser.add_argument("--api-key", default=os.getenv("GEMINI_API_KEY"))
+    parser.add_argument("--base-url", default=os.getenv("GEMINI_BASE_URL"),
+                        help="generateContent URL, e.g. of mock_gemini.py for offline runs")
+    parser.add_argument("--host", default=os.getenv("DB_HOST") or "localhost")
+    parser.add_argument("--user", default=os.getenv("DB_USER") or "root")
+    parser.add_argument("--password", default=os.getenv("DB_PASSWORD", ""))
+    parser.add_argument("--database", default=os.getenv("DB_NAME") or "company_db")
+    parser.add_argument("--port", type=int, default=int(os.getenv("DB_PORT") or 3306))
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="save every Gemini reply to this file")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="answer from a recorded file instead of calling Gemini")
+    parser.add_argument("--replay-latency", default="recorded",
+                        help='"recorded", "none" or a fixed number of seconds per replayed reply')
+    parser.add_argument("--match-on", choices=["request", "question"], default="request",
+                        help="replay by whole request, or by question only to compare prompt changes")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the Gemini and query result caches (always on with --replay)")
+    return parser.parse_args(argv)
+
+
+def open_cassette(args):
+    if not (args.record or args.replay):
+        return None
+    latency = args.replay_latency
+    if latency == "none":
+        latency = None
+    elif latency != "recorded":
+        latency = float(latency)
+    mode = RECORD if args.record else REPLAY
+    return Cassette(args.record or args.replay, mode, latency=latency, match_on=args.match_on)
+
+
+def main(argv=None):
+    if load_dotenv:
+        load_dotenv()
+    args = parse_args(argv)
+
+    # Replays never reach the API
+    if args.replay and not args.api_key:
+        args.api_key = "replay"
+    if not args.api_key:
+        print("A Gemini API key is required (--api-key or GEMINI_API_KEY)", file=sys.stderr)
+        return 2
+
+    questions = read_questions(args.questions)
+    if not questions:
+        print(f"No questions in {args.questions}", file=sys.stderr)
+        return 2
+
+    db_manager = DatabaseManager()
+    if not db_manager.connect(args.host, args.user, args.password, args.database, args.port):
+        print(f"Could not connect to {args.host}:{args.port}/{args.database}", file=sys.stderr)
+        return 1
+
+    # A replay served from cache would measure the cache, not the recorded run
+    use_cache = not (args.no_cache or args.replay)
+    agent = GeminiNL2SQL(
+        args.api_key, None if use_cache else NullCacheBackend(), quiet=True, base_url=args.base_url
+    )
+    if not use_cache:
+        agent.memory_cache = NullCacheBackend()
+        db_manager.result_cache = None
+    agent.client.rate_limiter = TokenBucket(rate=args.rate, capacity=max(1, int(args.rate)))
+    agent.cassette = open_cassette(args)
+
+    pipeline = NL2SQLPipeline(
+        agent, db_manager, args.confidential,
+        generation_workers=args.concurrency, execution_workers=args.db_concurrency
+    )
+    output_dir = Path(args.output)
+    start = time.monotonic()
+    try:
+        rows = asyncio.run(run_batch(pipeline, questions, output_dir, args.format))
+    finally:
+        pipeline.close()
+    elapsed = time.monotonic() - start
+
+    summary = pd.DataFrame(rows).astype({'rows': 'Int64'})
+    write_frame(summary, output_dir / f"summary.{args.format}", args.format)
+    failed = sum(1 for row in rows if row['error'])
+    print(
+        f"{len(rows)} questions in {elapsed:.1f}s ({len(rows) / elapsed:.1f}/s), {failed} failed; "
+        f"summary in {output_dir / f'summary.{args.format}'}",
+        file=sys.stderr
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,911 @@
+"""Caching helpers for the NL2SQL app.
+
+Streamlit re-executes app.py on every rerun, so anything that has to
+survive between reruns and be shared by all sessions of one server
+process lives in this module instead.
+"""
+import base64
+import bisect
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_CACHE_PATH = Path("gemini_cache") / "cache.sqlite3"
+
+CacheEntry = namedtuple("CacheEntry", ["value", "created_at", "expires_at"])
+
+# fresh_ttl:  age up to which an entry is served as-is
+# max_age:    hard limit; between fresh_ttl and this the entry is served
+#             stale while a background refresh replaces it
+# memory_ttl: longest an entry stays in the in-process tier before it is
+#             re-read from the persistent tier
+CachePolicy = namedtuple("CachePolicy", ["fresh_ttl", "max_age", "memory_ttl"])
+DEFAULT_CACHE_POLICY = CachePolicy(fresh_ttl=DEFAULT_TTL_SECONDS, max_age=24 * 3600, memory_ttl=DEFAULT_TTL_SECONDS)
+
+
+def _entry_times(created_at, expires_at, ttl):
+    created_at = time.time() if created_at is None else created_at
+    expires_at = created_at + ttl if expires_at is None else expires_at
+    return created_at, expires_at
+
+
+class Histogram:
+    """Fixed-bucket histogram; bounds are inclusive upper edges"""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            index = bisect.bisect_left(self.bounds, value)
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+
+    def percentile(self, p):
+        """Upper bucket edge below which p percent of observations fall"""
+        with self._lock:
+            if not self.count:
+                return None
+            target = self.count * p / 100
+            seen = 0
+            for index, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= target:
+                    return self.bounds[index] if index < len(self.bounds) else float('inf')
+            return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+            return {
+                'buckets': dict(zip(labels, self.counts)),
+                'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+            }
+
+
+class CacheStats:
+    """Counters and histograms describing how well the Gemini cache works"""
+
+    SIZE_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+    AGE_BOUNDS = (1, 10, 60, 300, 900, 1800, 3600, 86400)
+
+    def __init__(self, default_upstream_latency=2.0):
+        self._lock = threading.Lock()
+        self.default_upstream_latency = default_upstream_latency
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {
+                'memory_hits': 0,
+                'disk_hits': 0,
+                'stale_hits': 0,
+                'revalidations': 0,
+                'misses': 0,
+                'writes': 0,
+                'route_writes': 0,  # question -> tables entries, kept out of writes and entry sizes
+                'memory_expirations': 0,
+                'disk_expirations': 0,
+                'memory_evictions': 0,
+                'disk_purged': 0,
+                'local_answers': 0,
+            }
+            self.entry_sizes = Histogram(self.SIZE_BOUNDS)
+            self.entry_ages = Histogram(self.AGE_BOUNDS)
+            self.upstream_latency = None  # EWMA of Gemini call latency, seconds
+            self.latency_saved = 0.0
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_hit(self, tier, age):
+        """A lookup served from the 'memory' or 'disk' tier instead of Gemini"""
+        with self._lock:
+            self.counters[f"{tier}_hits"] += 1
+            self.latency_saved += self.upstream_latency or self.default_upstream_latency
+        self.entry_ages.observe(age)
+
+    def record_local_answer(self):
+        """A question answered by the local intent engine instead of Gemini"""
+        with self._lock:
+            self.counters['local_answers'] += 1
+            self.latency_saved += self.upstream_latency or self.default_upstream_latency
+
+    def record_miss(self):
+        self.increment('misses')
+
+    def record_write(self, size):
+        self.increment('writes')
+        self.entry_sizes.observe(size)
+
+    def record_upstream_latency(self, latency, alpha=0.2):
+        with self._lock:
+            if self.upstream_latency is None:
+                self.upstream_latency = latency
+            else:
+                self.upstream_latency += alpha * (latency - self.upstream_latency)
+
+    @property
+    def hit_ratio(self):
+        with self._lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            total = hits + self.counters['misses']
+        return hits / total if total else None
+
+    def snapshot(self):
+        """Plain-dict view for display or export"""
+        hit_ratio = self.hit_ratio
+        with self._lock:
+            data = dict(self.counters)
+            data['hit_ratio'] = hit_ratio
+            data['upstream_latency'] = self.upstream_latency
+            data['latency_saved'] = self.latency_saved
+        data['entry_sizes'] = self.entry_sizes.snapshot()
+        data['entry_ages'] = self.entry_ages.snapshot()
+        data['entry_size_p50'] = self.entry_sizes.percentile(50)
+        data['entry_size_p95'] = self.entry_sizes.percentile(95)
+        data['entry_age_p50'] = self.entry_ages.percentile(50)
+        data['entry_age_p95'] = self.entry_ages.percentile(95)
+        return data
+
+
+def value_size(value):
+    """Approximate payload size of a cached value"""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+ENTRY_FORMAT_VERSION = 1
+_FLAG_COMPRESSED = 0x01
+_FIELDS = ('sql', 'schema_fingerprint', 'raw')
+
+
+def encode_entry(sql, schema_fingerprint="", raw=None):
+    """Pack a cache entry into a compact binary record
+
+    Layout: version byte, flags byte, then the fields as 4-byte
+    length-prefixed UTF-8 strings (empty for missing), zlib-compressed
+    when that is actually smaller.
+    """
+    values = {'sql': sql, 'schema_fingerprint': schema_fingerprint, 'raw': raw}
+    payload = b"".join(
+        struct.pack(">I", len(data)) + data
+        for data in ((values[field] or "").encode() for field in _FIELDS)
+    )
+
+    flags = 0
+    compressed = zlib.compress(payload, 6)
+    if len(compressed) < len(payload):
+        payload = compressed
+        flags |= _FLAG_COMPRESSED
+    return bytes([ENTRY_FORMAT_VERSION, flags]) + payload
+
+
+def decode_entry(value):
+    """Inverse of encode_entry; plain strings from older entries come back as raw text"""
+    if isinstance(value, str):
+        return {'sql': None, 'schema_fingerprint': None, 'raw': value}
+
+    version, flags = value[0], value[1]
+    if version != ENTRY_FORMAT_VERSION:
+        raise ValueError(f"Unknown cache entry format {version}")
+
+    payload = value[2:]
+    if flags & _FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+
+    entry = {}
+    offset = 0
+    for field in _FIELDS:
+        (length,) = struct.unpack_from(">I", payload, offset)
+        offset += 4
+        entry[field] = payload[offset:offset + length].decode() or None
+        offset += length
+    return entry
+
+
+class MemoryLRUCache:
+    """Thread-safe in-process LRU bounded by entry count and bytes"""
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=DEFAULT_TTL_SECONDS, stats=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = stats
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the CacheEntry, or None on a miss or expired entry"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+
+            entry, size = item
+            if time.time() >= entry.expires_at:
+                del self._entries[key]
+                self._bytes -= size
+                if self.stats:
+                    self.stats.increment('memory_expirations')
+                return None
+
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        """Store a value; explicit times let promoted entries keep their age"""
+        created_at, expires_at = _entry_times(created_at, expires_at, self.ttl)
+        size = value_size(value)
+
+        # Never let a single oversized entry flush the whole cache
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key not in self._entries and not self._admit(key, size):
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (CacheEntry(value, created_at, expires_at), size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                if self.stats:
+                    self.stats.increment('memory_evictions')
+
+    def _admit(self, key, size):
+        """Admission policy hook, called with the lock held for new keys"""
+        return True
+
+    def delete(self, key):
+        """Remove a single entry if present"""
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FrequencySketch:
+    """Count-min sketch of recent access frequency with periodic halving"""
+
+    def __init__(self, width=4096, depth=4, sample_size=None):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or width * 10
+        self._rows = [[0] * width for _ in range(depth)]
+        self._additions = 0
+        self._lock = threading.Lock()
+
+    def _indexes(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[i * 4:(i + 1) * 4], 'big') % self.width for i in range(self.depth)]
+
+    def increment(self, key):
+        with self._lock:
+            for row, index in zip(self._rows, self._indexes(key)):
+                row[index] += 1
+            self._additions += 1
+            # Age old counts so the sketch follows the current workload
+            if self._additions >= self.sample_size:
+                for row in self._rows:
+                    for i in range(self.width):
+                        row[i] >>= 1
+                self._additions //= 2
+
+    def estimate(self, key):
+        with self._lock:
+            return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+
+class TinyLFUCache(MemoryLRUCache):
+    """LRU whose admissions are gated by access frequency (TinyLFU)
+
+    When a new entry would force evictions it is only admitted if it has
+    been requested more often than every entry it would displace, so a
+    burst of one-off queries cannot flush the frequently repeated ones.
+    """
+
+    def __init__(self, *args, sketch_width=4096, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sketch = FrequencySketch(width=sketch_width)
+
+    def get(self, key):
+        self.sketch.increment(key)
+        return super().get(key)
+
+    def _admit(self, key, size):
+        entries_over = len(self._entries) + 1 - self.max_entries
+        bytes_over = self._bytes + size - self.max_bytes
+        if entries_over <= 0 and bytes_over <= 0:
+            return True
+
+        candidate = self.sketch.estimate(key)
+        for victim_key, (_, victim_size) in self._entries.items():
+            if self.sketch.estimate(victim_key) >= candidate:
+                return False
+            entries_over -= 1
+            bytes_over -= victim_size
+            if entries_over <= 0 and bytes_over <= 0:
+                return True
+        return True
+
+
+class JSONFileCacheBackend:
+    """Legacy backend: one <key>.json file per entry in a directory"""
+
+    def __init__(self, cache_dir="gemini_cache", ttl=DEFAULT_TTL_SECONDS, stats=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.stats = stats
+
+    def get(self, key):
+        cache_file = self.cache_dir / f"{key}.json"
+        try:
+            with open(cache_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        created_at = data.get('created_at')
+        if created_at is None and 'timestamp' in data:
+            # Entries written before expiry metadata was stored
+            created_at = datetime.fromisoformat(data['timestamp']).timestamp()
+        created_at, expires_at = _entry_times(created_at, data.get('expires_at'), self.ttl)
+        if time.time() >= expires_at:
+            if self.stats:
+                self.stats.increment('disk_expirations')
+            return None
+        if 'response_b64' in data:
+            return CacheEntry(base64.b64decode(data['response_b64']), created_at, expires_at)
+        return CacheEntry(data['response'], created_at, expires_at)
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        created_at, expires_at = _entry_times(created_at, expires_at, self.ttl)
+        cache_file = self.cache_dir / f"{key}.json"
+        tmp_file = cache_file.with_suffix(f".{threading.get_ident()}.tmp")
+
+        data = {'created_at': created_at, 'expires_at': expires_at}
+        if isinstance(value, bytes):
+            data['response_b64'] = base64.b64encode(value).decode()
+        else:
+            data['response'] = value
+
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        # Atomic on POSIX and Windows, readers never see a half-written file
+        tmp_file.replace(cache_file)
+
+    def delete(self, key):
+        (self.cache_dir / f"{key}.json").unlink(missing_ok=True)
+
+    def purge_expired(self):
+        """Delete expired entry files, returns the number removed"""
+        removed = 0
+        for cache_file in self.cache_dir.glob("*.json"):
+            key = cache_file.stem
+            if self.get(key) is None:
+                cache_file.unlink(missing_ok=True)
+                removed += 1
+        if self.stats:
+            self.stats.increment('disk_purged', removed)
+        return removed
+
+    def size_info(self):
+        """(entry count, total bytes) currently on disk"""
+        files = list(self.cache_dir.glob("*.json"))
+        return len(files), sum(f.stat().st_size for f in files)
+
+    def close(self):
+        pass
+
+
+class SQLiteCacheBackend:
+    """Single-file cache store using SQLite in WAL mode
+
+    Safe for concurrent readers and writers across threads (one
+    connection per thread) and processes (WAL + busy timeout). Expired
+    rows are removed by a background purge thread using the expiry index.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL_SECONDS, purge_interval=600, stats=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.stats = stats
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._stop = threading.Event()
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries (expires_at)")
+
+        self._purge_thread = None
+        if purge_interval:
+            self._purge_thread = threading.Thread(
+                target=self._purge_loop, name="gemini-cache-purge", daemon=True
+            )
+            self._purge_thread.start()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, created_at, expires_at FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        entry = CacheEntry(*row)
+        if time.time() >= entry.expires_at:
+            # Left for the purge thread, which deletes in bulk
+            if self.stats:
+                self.stats.increment('disk_expirations')
+            return None
+        return entry
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        created_at, expires_at = _entry_times(created_at, expires_at, self.ttl)
+        # Autocommit: each statement is its own atomic transaction
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, value, created_at, expires_at)
+        )
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        """Delete expired rows, returns the number removed"""
+        cursor = self._connection().execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        if self.stats:
+            self.stats.increment('disk_purged', cursor.rowcount)
+        return cursor.rowcount
+
+    def size_info(self):
+        """(entry count, total value bytes) currently stored"""
+        count, total = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache_entries"
+        ).fetchone()
+        return count, total
+
+    def _purge_loop(self):
+        while not self._stop.wait(self.purge_interval):
+            try:
+                self.purge_expired()
+            except sqlite3.Error:
+                # Another process may hold the write lock; try next round
+                pass
+
+    def close(self):
+        self._stop.set()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of redis-py used by RedisCacheBackend
+
+    Same method names, bytes values and expiry semantics, so tests and
+    single-node setups can use "local://" instead of a Redis server.
+    """
+
+    def __init__(self):
+        self._data = {}  # name -> (bytes, expires at monotonic or None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def _live(self, name):
+        item = self._data.get(name)
+        if item is not None and item[1] is not None and time.monotonic() >= item[1]:
+            del self._data[name]
+            return None
+        return item
+
+    def ping(self):
+        return True
+
+    def get(self, name):
+        with self._lock:
+            item = self._live(self._encode(name))
+            return item[0] if item else None
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        name = self._encode(name)
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            ttl = px / 1000 if px is not None else ex
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            self._data[name] = (self._encode(value), expires_at)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                name = self._encode(name)
+                if self._live(name) is not None:
+                    del self._data[name]
+                    removed += 1
+            return removed
+
+    def pttl(self, name):
+        with self._lock:
+            item = self._live(self._encode(name))
+            if item is None:
+                return -2
+            if item[1] is None:
+                return -1
+            return int((item[1] - time.monotonic()) * 1000)
+
+    def strlen(self, name):
+        value = self.get(name)
+        return len(value) if value is not None else 0
+
+    def scan_iter(self, match=None, count=None):
+        pattern = self._encode(match).decode() if match else None
+        with self._lock:
+            names = [name for name in list(self._data) if self._live(name) is not None]
+        for name in names:
+            if pattern is None or fnmatch.fnmatchcase(name.decode(), pattern):
+                yield name
+
+    def dbsize(self):
+        return len(list(self.scan_iter()))
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+
+class RedisCacheBackend:
+    """Cache backend on a Redis-protocol store shared by all replicas
+
+    Values are stored with a small header carrying created_at and
+    expires_at; the store's own PX expiry enforces the same TTL, so no
+    purge pass is needed.
+    """
+
+    _HEADER = struct.Struct(">cdd")
+
+    def __init__(self, client, prefix="nl2sql:gemini:", ttl=DEFAULT_TTL_SECONDS, stats=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stats = stats
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+
+        kind, created_at, expires_at = self._HEADER.unpack_from(data)
+        if time.time() >= expires_at:
+            if self.stats:
+                self.stats.increment('disk_expirations')
+            return None
+        value = data[self._HEADER.size:]
+        return CacheEntry(value.decode() if kind == b's' else value, created_at, expires_at)
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        created_at, expires_at = _entry_times(created_at, expires_at, self.ttl)
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+
+        if isinstance(value, str):
+            kind, value = b's', value.encode()
+        else:
+            kind = b'b'
+        self.client.set(self.prefix + key, self._HEADER.pack(kind, created_at, expires_at) + value, px=ttl_ms)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def purge_expired(self):
+        """Expiry is handled by the store itself"""
+        return 0
+
+    def size_info(self):
+        """(entry count, total bytes) under this backend's prefix"""
+        count = total = 0
+        for name in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            count += 1
+            total += self.client.strlen(name)
+        return count, total
+
+    def close(self):
+        pass
+
+
+class NullCacheBackend:
+    """Backend that stores nothing"""
+
+    ttl = DEFAULT_TTL_SECONDS
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def purge_expired(self):
+        return 0
+
+    def size_info(self):
+        return 0, 0
+
+    def close(self):
+        pass
+
+
+class FallbackCacheBackend:
+    """Use a shared backend, degrading to a local one while it is unreachable
+
+    After a failure the shared backend is skipped for retry_interval
+    seconds, so an outage costs one timeout rather than one per lookup.
+    """
+
+    def __init__(self, primary, fallback, retry_interval=30):
+        self.primary = primary
+        self.fallback = fallback
+        self.retry_interval = retry_interval
+        self.ttl = fallback.ttl
+        self._retry_at = 0.0
+
+    @property
+    def primary_available(self):
+        return time.monotonic() >= self._retry_at
+
+    def _call(self, method, *args):
+        if self.primary_available:
+            try:
+                return getattr(self.primary, method)(*args)
+            except Exception:
+                self._retry_at = time.monotonic() + self.retry_interval
+        return getattr(self.fallback, method)(*args)
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        return self._call('set', key, value, created_at, expires_at)
+
+    def delete(self, key):
+        return self._call('delete', key)
+
+    def purge_expired(self):
+        # The fallback may hold entries written during an outage
+        removed = self.fallback.purge_expired()
+        if self.primary_available:
+            removed += self._call('purge_expired')
+        return removed
+
+    def size_info(self):
+        return self._call('size_info')
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+class SharedResultCache:
+    """Local frequency-gated tier in front of a shared store for query results
+
+    Values are serialized with dumps/loads for the shared tier; anything
+    that cannot be serialized simply stays local.
+    """
+
+    def __init__(self, local, shared, dumps, loads):
+        self.local = local
+        self.shared = shared
+        self.dumps = dumps
+        self.loads = loads
+        self.ttl = local.ttl
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+
+        try:
+            entry = self.shared.get(key)
+            if entry is None:
+                return None
+            value = self.loads(entry.value)
+        except Exception:
+            return None
+        self.local.set(key, value, entry.created_at, entry.expires_at)
+        return CacheEntry(value, entry.created_at, entry.expires_at)
+
+    def set(self, key, value, created_at=None, expires_at=None):
+        created_at, expires_at = _entry_times(created_at, expires_at, self.ttl)
+        self.local.set(key, value, created_at, expires_at)
+        try:
+            self.shared.set(key, self.dumps(value), created_at, expires_at)
+        except Exception:
+            pass
+
+    def delete(self, key):
+        self.local.delete(key)
+        try:
+            self.shared.delete(key)
+        except Exception:
+            pass
+
+    def clear(self):
+        self.local.clear()
+
+    def __len__(self):
+        return len(self.local)
+
+
+def dataframe_to_bytes(df):
+    """Parquet-encode a DataFrame for the shared result tier"""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def dataframe_from_bytes(data):
+    import pandas as pd
+    return pd.read_parquet(io.BytesIO(data))
+
+
+_local_redis = LocalRedis()
+
+
+def connect_shared_store(url):
+    """Client for a Redis-protocol store; "local://" gives the in-process stand-in"""
+    if url.startswith("local://"):
+        return _local_redis
+
+    import redis  # Optional dependency, only needed for a real shared store
+    return redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+def _shared_client():
+    url = os.environ.get("REDIS_URL")
+    if not url:
+        return None
+    try:
+        return connect_shared_store(url)
+    except ImportError:
+        return None
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+_result_cache = None
+
+
+def purge_legacy_entries(cache_dir):
+    """Remove <key>.json files left by JSONFileCacheBackend, in the background
+
+    The SQLite file shares their directory; they are all past the old TTL
+    and nothing reads them any more.
+    """
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_dir() or next(cache_dir.glob("*.json"), None) is None:
+        return
+    thread = threading.Thread(
+        target=JSONFileCacheBackend(cache_dir).purge_expired, name="gemini-cache-legacy-purge", daemon=True
+    )
+    thread.start()
+
+
+def get_cache_backend(path=DEFAULT_CACHE_PATH):
+    """Return the process-wide cache backend for a path
+
+    With REDIS_URL set, entries live in the shared store and the SQLite
+    file at path is only used while that store is unreachable.
+    """
+    path = Path(path).resolve()
+    with _backends_lock:
+        if path not in _backends:
+            backend = SQLiteCacheBackend(path, stats=cache_stats)
+            purge_legacy_entries(path.parent)
+            client = _shared_client()
+            if client is not None:
+                backend = FallbackCacheBackend(RedisCacheBackend(client, stats=cache_stats), backend)
+            _backends[path] = backend
+        return _backends[path]
+
+
+def get_result_cache():
+    """Return the process-wide query result cache, shared across replicas when REDIS_URL is set"""
+    global _result_cache
+    with _backends_lock:
+        if _result_cache is None:
+            _result_cache = query_result_cache
+            client = _shared_client()
+            if client is not None:
+                shared = FallbackCacheBackend(
+                    RedisCacheBackend(client, prefix="nl2sql:results:", ttl=query_result_cache.ttl),
+                    NullCacheBackend()
+                )
+                _result_cache = SharedResultCache(
+                    query_result_cache, shared, dataframe_to_bytes, dataframe_from_bytes
+                )
+        return _result_cache
+
+
+# Shared by every GeminiNL2SQL instance in this process
+cache_stats = CacheStats()
+response_memory_cache = MemoryLRUCache(stats=cache_stats)
+# DataFrames keyed on normalized SQL + table data versions, see DatabaseManager
+query_result_cache = TinyLFUCache(max_entries=256, max_bytes=64 * 1024 * 1024, ttl=600)
+# (question, schema) pairs that recently failed upstream, skipped for a short window
+failed_request_cache = MemoryLRUCache(max_entries=512, max_bytes=1024 * 1024, ttl=60)
+# Compiled IntentEngines by schema fingerprint and sampled values, shared by all sessions
+intent_engine_cache = MemoryLRUCache(max_entries=32, max_bytes=1024 * 1024, ttl=86400)
@@ -0,0 +1,133 @@
+"""Record and replay Gemini responses for reproducible benchmarks.
+
+In record mode every generateContent call (streamed or not) is appended
+to a JSON-lines cassette with its status, body and latency. In replay
+mode nothing goes upstream: responses come from the cassette, after the
+recorded latency, a fixed one or none. That isolates prompt building,
+parsing, execution and rendering from the live API's noise.
+
+Requests are matched on the whole request body by default, except for
+generationConfig.maxOutputTokens, which the agent adjusts as it learns.
+With match_on="question" only the question is matched, so runs can be
+compared across prompt changes.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+
+QUESTION_RE = re.compile(r"Now generate the SQL for: (.*)\s*$", re.DOTALL)
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class CassetteMiss(KeyError):
+    """Replay found no recorded response for a request"""
+
+
+class CassetteResponse:
+    """The parts of requests.Response the agent reads, rebuilt from a cassette entry"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def close(self):
+        pass
+
+
+class Cassette:
+    def __init__(self, path, mode=REPLAY, latency="recorded", match_on="request"):
+        """latency: "recorded", None for no delay, or a fixed number of seconds"""
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.match_on = match_on
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        # Entries by request key and by question key, so either match works on any cassette
+        self._entries = {}
+        self._by_question = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        # Later recordings of the same request win
+                        self._add(json.loads(line))
+        except FileNotFoundError:
+            if self.replaying:
+                raise
+
+    def _add(self, entry):
+        self._entries[entry['key']] = entry
+        self._by_question[entry['question_key']] = entry
+
+    @staticmethod
+    def request_key(data):
+        # maxOutputTokens follows the learned output budget, so it differs between otherwise equal runs
+        generation_config = {
+            name: value for name, value in data.get("generationConfig", {}).items() if name != "maxOutputTokens"
+        }
+        keyed = dict(data, generationConfig=generation_config)
+        return hashlib.md5(json.dumps(keyed, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def question_key(data):
+        text = "".join(
+            part.get("text", "") for content in data.get("contents", []) for part in content.get("parts", [])
+        )
+        match = QUESTION_RE.search(text)
+        return hashlib.md5((match.group(1).strip() if match else text).encode()).hexdigest()
+
+    def record(self, data, status_code, body, latency):
+        """Append a response; body is the parsed result, or the raw text for errors"""
+        entry = {
+            'key': self.request_key(data),
+            'question_key': self.question_key(data),
+            'status': status_code,
+            'body': body if isinstance(body, str) else json.dumps(body),
+            'latency': round(latency, 4),
+            'recorded_at': time.time(),
+        }
+        with self._lock:
+            self._add(entry)
+            self.recorded += 1
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def replay(self, data):
+        """(response, result) as returned by post_to_gemini, after the configured delay"""
+        if self.match_on == "question":
+            entry = self._by_question.get(self.question_key(data))
+        else:
+            entry = self._entries.get(self.request_key(data))
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            raise CassetteMiss(f"No recorded Gemini response for this request in {self.path}")
+
+        with self._lock:
+            self.hits += 1
+        delay = entry['latency'] if self.latency == "recorded" else self.latency
+        if delay:
+            time.sleep(delay)
+
+        response = CassetteResponse(entry['status'], entry['body'])
+        return response, response.json() if response.status_code == 200 else None
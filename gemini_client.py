@@ -0,0 +1,484 @@
+"""HTTP client for the Gemini generateContent API.
+
+One client per (API key, endpoint) is shared by every session in the
+process, so its connection pool and rate limiter are shared too.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def stream_url_for(base_url):
+    """streamGenerateContent (server-sent events) URL for a generateContent URL"""
+    return base_url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+
+
+def cached_contents_url_for(base_url):
+    """cachedContents collection URL and model resource name for a generateContent URL"""
+    root, _, model_method = base_url.partition("/models/")
+    return f"{root}/cachedContents", "models/" + model_method.split(":")[0]
+
+
+def iter_sse_text(response):
+    """Yield the text parts of a streamGenerateContent SSE response as they arrive"""
+    # chunk_size=None hands over each chunked-encoding chunk as it arrives instead of buffering 512 bytes
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        event = json.loads(line[5:])
+        if 'error' in event:
+            raise ValueError(f"Gemini stream error: {event['error'].get('message', event['error'])}")
+        for candidate in event.get('candidates', [])[:1]:
+            for part in candidate.get('content', {}).get('parts', []):
+                if 'text' in part:
+                    yield part['text']
+
+
+class ContextCache:
+    """Names of server-side cached contexts (cachedContents) by caller key
+
+    Callers key contexts on something cheap (schema fingerprint and mode)
+    and pass a function building the prefix, which only runs when a
+    context has to be created. get() never blocks on the API: a missing context is created in the
+    background and the caller sends its full prompt meanwhile. Contexts
+    are kept alive by extending their TTL once they are within
+    `refresh_margin` seconds of expiring. A prefix the API refuses to
+    cache (too short, model without caching...) is not retried for
+    `retry_after` seconds.
+    """
+
+    def __init__(self, client, ttl=3600, refresh_margin=300, retry_after=3600):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.url, self.model = cached_contents_url_for(client.base_url)
+        self.hits = 0
+        self._contexts = {}  # key -> (name, expires_at)
+        self._unsupported = {}  # key -> retry at
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini-context-cache")
+
+    def get(self, key, build_prefix):
+        """Cached content name for a key, None (and start creating it from build_prefix()) if there is none"""
+        now = time.time()
+        with self._lock:
+            if now < self._unsupported.get(key, 0):
+                return None
+            name, expires_at = self._contexts.get(key, (None, 0))
+            if name and now >= expires_at:
+                del self._contexts[key]
+                name = None
+
+            if name and expires_at - now < self.refresh_margin:
+                self._submit(key, self._extend, key, name)
+            elif not name:
+                self._submit(key, self._create, key, build_prefix)
+
+            if name:
+                self.hits += 1
+            return name
+
+    def invalidate(self, key):
+        """Forget a context the API no longer accepts, e.g. deleted or expired early"""
+        with self._lock:
+            self._contexts.pop(key, None)
+
+    def _submit(self, key, fn, *args):
+        # Called with the lock held; one create or extend per key at a time
+        if key in self._pending:
+            return
+        self._pending.add(key)
+
+        def run():
+            try:
+                fn(*args)
+            except Exception:
+                # Callers keep sending full prompts until a later attempt works
+                pass
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+
+    def _store(self, key, response):
+        if response.status_code != 200:
+            if 400 <= response.status_code < 500 and response.status_code != 429:
+                with self._lock:
+                    self._contexts.pop(key, None)
+                    self._unsupported[key] = time.time() + self.retry_after
+            return
+        result = response.json()
+        # Trust our own TTL rather than parsing expireTime
+        with self._lock:
+            self._contexts[key] = (result['name'], time.time() + self.ttl)
+
+    def _create(self, key, build_prefix):
+        response = self.client.post(self.url, {
+            "model": self.model,
+            "contents": [{"role": "user", "parts": [{"text": build_prefix()}]}],
+            "ttl": f"{self.ttl}s"
+        })
+        self._store(key, response)
+
+    def _extend(self, key, name):
+        response = self.client.patch(f"{self.url.rsplit('/', 1)[0]}/{name}?updateMask=ttl", {"ttl": f"{self.ttl}s"})
+        self._store(key, response)
+
+
+class RateLimited(Exception):
+    """No request slot became available within the wait limit"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, bursts up to `capacity`"""
+
+    def __init__(self, rate=5.0, capacity=10):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=10.0):
+        """Take one token, waiting up to timeout seconds; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls, for percentiles"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, q):
+        """q-th quantile (0-1) of recent latencies, None until min_samples are recorded"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class OutputTokenBudget:
+    """maxOutputTokens per question complexity, tuned from observed reply sizes
+
+    Until `min_samples` replies of a complexity have been seen the
+    default is used; after that the budget is `headroom` times the
+    largest recent reply, between `minimum` and `maximum`. A truncated
+    reply (finishReason MAX_TOKENS) raises the headroom of its
+    complexity so the budget corrects itself.
+    """
+
+    def __init__(self, default=1000, minimum=128, maximum=2048, headroom=1.5, window=50, min_samples=10):
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.requests = 0
+        self.truncations = 0
+        self._sizes = defaultdict(lambda: deque(maxlen=window))
+        self._headroom = defaultdict(lambda: headroom)
+        self._lock = threading.Lock()
+
+    def budget(self, complexity):
+        with self._lock:
+            sizes = self._sizes[complexity]
+            if len(sizes) < self.min_samples:
+                return self.default
+            return int(min(self.maximum, max(self.minimum, max(sizes) * self._headroom[complexity])))
+
+    def observe(self, complexity, tokens, truncated=False):
+        """Record the output tokens of a reply and whether it hit the budget"""
+        with self._lock:
+            self.requests += 1
+            if truncated:
+                self.truncations += 1
+                self._headroom[complexity] *= 1.25
+            elif tokens:
+                self._sizes[complexity].append(tokens)
+
+    @property
+    def truncation_rate(self):
+        return self.truncations / self.requests if self.requests else 0.0
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiClient:
+    """Keep-alive connection pool with bounded, jittered retries and rate limiting
+
+    generateContent timeouts adapt to observed latency: once enough calls
+    with a similar maxOutputTokens have been seen the timeout is
+    `timeout_multiplier` times their p99, between `min_timeout` and
+    `timeout`; long replies are not held to the pace of short ones. With
+    hedging, a call still running after that p95 latency gets a duplicate
+    and whichever succeeds first wins; at most `max_hedge_ratio` of
+    recent calls are hedged.
+    """
+
+    def __init__(self, api_key, base_url, pool_size=10, timeout=30, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, max_retry_wait=10.0, rate_limiter=None,
+                 min_timeout=5.0, timeout_multiplier=3.0, max_hedge_ratio=0.1, connect_timeout=3.05):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.stream_url = stream_url_for(base_url)
+        self.timeout = timeout
+        # An unreachable host should fail fast, not hold a request for the whole read timeout
+        self.connect_timeout = connect_timeout
+        self.min_timeout = min_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.max_hedge_ratio = max_hedge_ratio
+        self.latency = LatencyTracker()
+        # Per maxOutputTokens bucket (next power of two), since reply length drives latency
+        self._latency_by_budget = {}
+        self._latency_lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._recent_hedges = deque(maxlen=100)
+        self._hedge_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="gemini-hedge")
+        self.context_cache = ContextCache(self)
+        self.output_budget = OutputTokenBudget()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_wait = max_retry_wait
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.last_used = 0.0
+
+        self.session = requests.Session()
+        # Retries are handled here so Retry-After and the rate limiter apply to them
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'X-goog-api-key': api_key
+        })
+
+    def warm_up(self):
+        """Open a pooled TLS connection in the background so the first question skips the handshake"""
+        parts = urlsplit(self.base_url)
+        origin = f"{parts.scheme}://{parts.netloc}/"
+
+        self.last_used = time.monotonic()
+
+        def connect():
+            try:
+                self.session.head(origin, timeout=5)
+            except requests.RequestException:
+                pass
+
+        threading.Thread(target=connect, name="gemini-warm-up", daemon=True).start()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url, data, timeout=None, method="post", **kwargs):
+        """POST (or another method) with rate limiting and retries on 429/5xx and connection errors
+
+        Returns the last response; read timeouts are not retried since
+        they already cost the full timeout. All attempts together, sleeps
+        included, end within timeout + max_retry_wait.
+        """
+        timeout = timeout or self.timeout
+        # Waiting longer than this is worse than falling back locally
+        deadline = time.monotonic() + timeout + self.max_retry_wait
+        attempt = 0
+        while True:
+            if not self.rate_limiter.acquire():
+                raise RateLimited("Gemini request rate limit reached")
+
+            self.last_used = time.monotonic()
+            read_timeout = max(min(timeout, deadline - self.last_used), self.connect_timeout)
+            try:
+                response = self.session.request(
+                    method, url, json=data, timeout=(self.connect_timeout, read_timeout), **kwargs
+                )
+            except requests.ConnectionError:
+                delay = self.backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay + self.connect_timeout > deadline:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                if time.monotonic() + delay + self.connect_timeout > deadline:
+                    return response
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def patch(self, url, data, timeout=None):
+        return self.post(url, data, timeout=timeout, method="patch")
+
+    def latency_for(self, data):
+        """LatencyTracker for requests with this body's output budget"""
+        tokens = data.get("generationConfig", {}).get("maxOutputTokens") or 0
+        bucket = 1 << (int(tokens) - 1).bit_length() if tokens else 0
+        with self._latency_lock:
+            tracker = self._latency_by_budget.get(bucket)
+            if tracker is None:
+                tracker = self._latency_by_budget[bucket] = LatencyTracker()
+            return tracker
+
+    def record_latency(self, data, latency):
+        self.latency.record(latency)
+        self.latency_for(data).record(latency)
+
+    def adaptive_timeout(self, data=None):
+        """Timeout for the next generateContent call from recent latencies of its output budget
+
+        A budget with too few samples yet (e.g. the maximum-budget retry
+        after a truncated reply) gets the full timeout.
+        """
+        tracker = self.latency if data is None else self.latency_for(data)
+        p99 = tracker.percentile(0.99)
+        if p99 is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def _timed_post(self, data, timeout):
+        start = time.monotonic()
+        response = self.post(self.base_url, data, timeout=timeout)
+        if response.status_code == 200:
+            self.record_latency(data, time.monotonic() - start)
+        return response
+
+    def _allow_hedge(self, hedged):
+        """Record whether this call wanted a hedge; False once the hedge budget is spent"""
+        with self._hedge_lock:
+            allowed = hedged and sum(self._recent_hedges) < self.max_hedge_ratio * (len(self._recent_hedges) + 1)
+            self._recent_hedges.append(allowed)
+            if allowed:
+                self.hedges += 1
+            return allowed
+
+    def _send_hedge(self, data, timeout):
+        # A hedge is optional: never wait for a rate limit slot or retry it
+        if not self.rate_limiter.acquire(timeout=0):
+            return None
+        start = time.monotonic()
+        response = self.session.post(self.base_url, json=data, timeout=(self.connect_timeout, timeout))
+        if response.status_code == 200:
+            self.record_latency(data, time.monotonic() - start)
+        return response
+
+    def generate_content(self, data, timeout=None, hedge=False):
+        timeout = timeout or self.adaptive_timeout(data)
+        hedge_after = self.latency_for(data).percentile(0.95) if hedge else None
+        if hedge_after is None:
+            self._allow_hedge(False)
+            return self._timed_post(data, timeout)
+
+        primary = self._executor.submit(self._timed_post, data, timeout)
+        try:
+            response = primary.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+        else:
+            self._allow_hedge(False)
+            return response
+
+        if not self._allow_hedge(True):
+            return primary.result()
+
+        backup = self._executor.submit(self._send_hedge, data, timeout)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result() is not None \
+                        and future.result().status_code == 200:
+                    # requests cannot abort a call in progress; the loser is discarded when it lands
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    if future is backup:
+                        self.hedge_wins += 1
+                    return future.result()
+
+        # Neither succeeded: report the primary's outcome as without hedging
+        return primary.result()
+
+    def stream_generate_content(self, data, timeout=None):
+        """Start a streaming request; read it with iter_sse_text and close it when done"""
+        return self.post(self.stream_url, data, timeout=timeout, stream=True)
+
+
+def _close_response(future):
+    if future.exception() is None and future.result() is not None:
+        future.result().close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Servers drop idle keep-alive connections after about a minute
+IDLE_REWARM_SECONDS = 50
+
+
+def get_gemini_client(api_key, base_url):
+    """Return the process-wide client for an API key and endpoint
+
+    The client's pool is warmed when it is created and again whenever it
+    has been idle long enough for the server to have closed it.
+    """
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            client = _clients[(api_key, base_url)] = GeminiClient(api_key, base_url)
+        if time.monotonic() - client.last_used >= IDLE_REWARM_SECONDS:
+            client.warm_up()
+        return client
@@ -0,0 +1,360 @@
+"""Local answers for simple questions, without a Gemini round trip.
+
+Rules are indexed by the keywords that trigger them (the table nouns) and
+only the groups a question mentions are evaluated, each group compiled on
+first use into one regular expression with an optional lookahead per
+rule. Each hit gets a confidence from the rule's base confidence, how
+much of the question the rule left unexplained and whether its captured
+value is a known value of the right column. Callers answer locally above
+a threshold and ask Gemini otherwise; long questions, or ones touching
+more rules than the budget allows, get no local answer at all.
+
+The rules are generated from the connected schema by rules_from_schema(),
+so the same templates work on any database the app is pointed at.
+"""
+import re
+from collections import defaultdict, namedtuple
+
+from schema_index import IDENTIFIER_RE, STOPWORDS, SYNONYMS, stem
+
+IntentRule = namedtuple(
+    "IntentRule",
+    ["name", "pattern", "sql", "confidence", "value_category", "confidential_sql", "tables", "keywords"],
+    defaults=(None, None, (), ())
+)
+Intent = namedtuple("Intent", ["rule", "sql", "confidence"])
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+NAME_TOKEN_RE = re.compile(r"\w+")
+# Words that do not change what a question asks for
+FILLER = STOPWORDS | {
+    'are', 'can', 'currently', 'display', 'do', 'does', 'find', 'get', 'i', 'our', 'please', 'see',
+    'tell', 'we', 'you', 'count', 'number', 'total', 'data', 'records', 'rows', 'sample', 'some',
+}
+# Spellings people use for values stored differently
+VALUE_ALIASES = {
+    'us': 'usa', 'america': 'usa', 'united states': 'usa', 'uk': 'united kingdom', 'britain': 'united kingdom',
+    'french': 'france', 'german': 'germany', 'spanish': 'spain', 'italian': 'italy', 'japanese': 'japan',
+}
+
+# Each unexplained word in the question costs this share of confidence
+RESIDUAL_PENALTY = 0.8
+# Captured value not among the sampled values of its column
+UNKNOWN_VALUE_PENALTY = 0.3
+# Captured value that could not be checked (no sampled values at all)
+UNVERIFIED_VALUE_PENALTY = 0.7
+
+# Local matching budget per question; beyond it the question goes to the cache and Gemini
+MAX_QUESTION_CHARS = 300
+MAX_RULES_PER_QUESTION = 500
+
+
+def sql_string(value):
+    # MySQL treats backslash as an escape inside string literals
+    return value.replace("\\", "\\\\").replace("'", "''")
+
+
+class RuleGroup:
+    """Rules evaluated together in one pass of a combined pattern, compiled on first use"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._compiled = None
+
+    def compile(self):
+        if self._compiled is None:
+            pattern = "".join(f"(?:(?=.*?(?P<r{i}>{rule.pattern})))?" for i, rule in enumerate(self.rules))
+            combined = re.compile(pattern, re.DOTALL)
+            # Index of each rule's value group in the combined pattern, None for rules without one
+            starts = [combined.groupindex[f"r{i}"] for i in range(len(self.rules))] + [combined.groups + 1]
+            value_groups = [start + 1 if end - start > 1 else None for start, end in zip(starts, starts[1:])]
+            # Words each rule spells out; other question words are detail the rule would ignore
+            rule_words = [
+                {stem(word) for word in WORD_RE.findall(re.sub(r"\\.", " ", rule.pattern))} for rule in self.rules
+            ]
+            self._compiled = combined, value_groups, rule_words
+        return self._compiled
+
+
+class IntentEngine:
+    """Keyword-indexed matcher over a list of IntentRule
+
+    literal_values is DatabaseManager.literal_values ({lowercase value:
+    (canonical value, category)}); tables, when given, drops rules that
+    need a table the database does not have. Rules without keywords are
+    evaluated for every question.
+    """
+
+    def __init__(self, rules, literal_values=None, tables=None, max_rules=MAX_RULES_PER_QUESTION):
+        if tables is not None:
+            available = {table.lower() for table in tables}
+            rules = [rule for rule in rules if all(t.lower() in available for t in rule.tables)]
+        self.rules = list(rules)
+        self.literal_values = literal_values or {}
+        self.max_rules = max_rules
+
+        # One group per keyword set, i.e. per table for generated rules
+        grouped = {}
+        for rule in self.rules:
+            grouped.setdefault(frozenset(rule.keywords), []).append(rule)
+        self._groups = [RuleGroup(group_rules) for group_rules in grouped.values()]
+        self._always = set()
+        self._index = defaultdict(set)
+        for i, keywords in enumerate(grouped):
+            if not keywords:
+                self._always.add(i)
+            for keyword in keywords:
+                self._index[keyword].add(i)
+
+    def resolve_value(self, value, category):
+        """(canonical value, confidence factor) for a value captured by a rule"""
+        value = re.sub(r"^the\s+", "", value.strip().strip("'\""))
+        if category is None:
+            return value, 1.0
+
+        key = VALUE_ALIASES.get(value.lower(), value.lower())
+        known = self.literal_values.get(key)
+        if known and category in known[1].split('|'):
+            return known[0], 1.0
+        if not self.literal_values:
+            return value.title(), UNVERIFIED_VALUE_PENALTY
+        return value.title(), UNKNOWN_VALUE_PENALTY
+
+    def select_groups(self, text, words):
+        """Indexes of the rule groups a question triggers, in rule order"""
+        terms = {stem(word) for _, word in words} | set(NAME_TOKEN_RE.findall(text))
+        selected = set(self._always)
+        for term in terms:
+            selected.update(self._index.get(term, ()))
+        return sorted(selected)
+
+    def candidates(self, question, confidential_mode=False):
+        """Every rule that matches, as Intents, most confident first"""
+        text = question.lower().strip()
+        if len(text) > MAX_QUESTION_CHARS:
+            return []
+        words = [(m.start(), m.group(0)) for m in WORD_RE.finditer(text)]
+
+        groups = [self._groups[i] for i in self.select_groups(text, words)]
+        if sum(len(group.rules) for group in groups) > self.max_rules:
+            return []
+
+        intents = []
+        for group in groups:
+            combined, value_groups, rule_words = group.compile()
+            match = combined.match(text)
+            for i, rule in enumerate(group.rules):
+                if match.start(f"r{i}") < 0:
+                    continue
+
+                template = rule.confidential_sql if confidential_mode and rule.confidential_sql else rule.sql
+                value_group = value_groups[i]
+                has_value = value_group is not None and match.start(value_group) >= 0
+                value_start, value_end = (match.start(value_group), match.end(value_group)) if has_value else (0, 0)
+
+                residual = sum(
+                    1 for pos, word in words
+                    if word not in FILLER and stem(word) not in rule_words[i] and not value_start <= pos < value_end
+                )
+                confidence = rule.confidence * RESIDUAL_PENALTY ** residual
+
+                if '{value}' in template and has_value and match.group(value_group):
+                    value, factor = self.resolve_value(match.group(value_group), rule.value_category)
+                    confidence *= factor
+                    sql = template.format(value=sql_string(value))
+                elif '{value}' in template:
+                    continue
+                else:
+                    sql = template
+
+                intents.append(Intent(rule, sql, confidence))
+
+        intents.sort(key=lambda intent: -intent.confidence)
+        return intents
+
+    def match(self, question, confidential_mode=False, min_confidence=0.0):
+        """The most confident Intent at or above min_confidence, else None"""
+        intents = self.candidates(question, confidential_mode)
+        if intents and intents[0].confidence >= min_confidence:
+            return intents[0]
+        return None
+
+
+NUMERIC_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint', 'decimal', 'numeric', 'float', 'double', 'real')
+# Last name terms of identifiers and codes, which are numbers but not measures
+KEY_TERMS = {'id', 'number', 'code', 'no', 'num'}
+# Columns left out of the SELECT list in confidential mode
+SENSITIVE_TERMS = {
+    'email', 'phone', 'mobile', 'fax', 'address', 'street', 'postal', 'zip', 'salary', 'password',
+    'ssn', 'birth', 'contact',
+}
+LIST_LIMIT = 50
+TOP_LIMIT = 10
+MENTION_LIMIT = 20
+
+# Not "total": "total payments" usually means a sum of amounts, which is left to Gemini
+COUNT_WORDS = r"(?:how many|number of|count(?: of)?)\s+(?:the\s+)?"
+TOP_WORDS = r"(?:top|highest|largest|biggest|most)"
+LIST_WORDS = r"(?:list|show|display|all|sample)"
+VALUE_CAPTURE = r"([a-z0-9][a-z0-9 .'&-]*?)\s*[?.!]*$"
+VALUE_BEFORE = r"([a-z0-9][a-z0-9 .'&-]*?)\s+"
+
+
+def name_words(name):
+    """['buy', 'price'] for buyPrice; digits are dropped, as in schema_index"""
+    return [word.lower() for word in IDENTIFIER_RE.findall(name)]
+
+
+def noun_forms(name):
+    """(leading words, [(plural, singular)...]) for a table name; None when it must be typed as-is"""
+    if any(ch.isdigit() for ch in name) or not name_words(name):
+        return None
+    *head, last = name_words(name)
+    singular = stem(last)
+    if singular.endswith('y') and not singular.endswith(('ay', 'ey', 'oy', 'uy')):
+        plural = singular[:-1] + 'ies'
+    elif singular.endswith(('s', 'x', 'ch', 'sh')):
+        plural = singular + 'es'
+    else:
+        plural = singular + 's'
+    forms = [(plural, singular)]
+    if not head:
+        # Single-word tables also answer to their synonyms: clients -> customers
+        forms.extend((f"{word}s", word) for word, concepts in SYNONYMS.items() if concepts == (singular,))
+    return head, forms
+
+
+def noun_pattern(name):
+    """Regex for a table named in a question: order_items, order items, "order item"..."""
+    parts = noun_forms(name)
+    if parts is None:
+        return re.escape(name.lower())
+    head, forms = parts
+    prefix = "".join(f"{re.escape(word)}[\\s_]*" for word in head)
+    return f"{prefix}(?:{'|'.join(f'{plural}|{singular}' for plural, singular in forms)})"
+
+
+def noun_keywords(name):
+    """Question terms (as stemmed by the engine) that can mention a table"""
+    parts = noun_forms(name)
+    if parts is None:
+        return (name.lower(),)
+    head, forms = parts
+    keywords = {stem(form) for pair in forms for form in pair}
+    # "orderitems" typed as one word
+    keywords.update(stem("".join(head) + form) for pair in forms for form in pair)
+    return tuple(sorted(keywords))
+
+
+def column_pattern(name):
+    """Regex for a column named in a question; leading words are optional, so buyPrice matches 'price'"""
+    words = name_words(name)
+    if not words:
+        return re.escape(name.lower())
+    return "".join(f"(?:{re.escape(word)}\\s*)?" for word in words[:-1]) + re.escape(words[-1])
+
+
+def quote(identifier):
+    return f"`{identifier.replace('`', '``')}`"
+
+
+def rules_from_schema(tables_info, literal_values=None):
+    """Count, list, top-N and filter rules for every table in DatabaseManager.tables_info
+
+    Top-N rules are made for numeric columns that are not keys; filter
+    and group-by rules for the categorical columns literal_values has
+    samples for, so a captured value can be checked against them.
+    """
+    categories = set()
+    for _, category in (literal_values or {}).values():
+        categories.update(category.split('|'))
+
+    rules = []
+    for table, columns in tables_info.items():
+        first_rule = len(rules)
+        noun = noun_pattern(table)
+        source = quote(table)
+        label = re.sub(r"\W+", "_", table.lower())
+
+        public = [col['name'] for col in columns if not SENSITIVE_TERMS & set(name_words(col['name']))]
+        names = [name for name in public if {'name', 'title'} & set(name_words(name))]
+        keys = [col['name'] for col in columns if col['key'] == 'PRI' and col['name'] in public]
+        categorical = [col['name'] for col in columns if col['name'].lower() in categories]
+        # Top-N rules have no confidential variant, so sensitive columns (salary...) are never measures
+        measures = [
+            col['name'] for col in columns
+            if str(col['type']).lower().startswith(NUMERIC_TYPES) and col['key'] not in ('PRI', 'MUL')
+            and col['name'] in public and not KEY_TERMS & set(name_words(col['name'])[-1:])
+        ]
+        public_select = ", ".join(quote(name) for name in public) or "*"
+        labels = ", ".join(quote(name) for name in (names or keys or public[:1]))
+
+        rules.append(IntentRule(
+            f"count_{label}", rf"\b{COUNT_WORDS}{noun}\b",
+            f"SELECT COUNT(*) AS total_{label} FROM {source}", 0.95, tables=(table,)
+        ))
+        rules.append(IntentRule(
+            f"list_{label}", rf"\b{LIST_WORDS}\b.*?\b{noun}\b",
+            f"SELECT * FROM {source} LIMIT {LIST_LIMIT}", 0.85,
+            confidential_sql=f"SELECT {public_select} FROM {source} LIMIT {LIST_LIMIT}", tables=(table,)
+        ))
+        # Any mention of the table; too vague to answer locally, but a runnable fallback
+        rules.append(IntentRule(
+            f"{label}_mentioned", rf"\b{noun}\b", f"SELECT * FROM {source} LIMIT {MENTION_LIMIT}", 0.5,
+            confidential_sql=f"SELECT {public_select} FROM {source} LIMIT {MENTION_LIMIT}", tables=(table,)
+        ))
+
+        for name in measures:
+            column = column_pattern(name)
+            order = f"SELECT {labels}, {quote(name)} FROM {source} ORDER BY {quote(name)} DESC LIMIT"
+            rules.append(IntentRule(
+                f"top_{label}_by_{name.lower()}", rf"\b{TOP_WORDS}\s+(\d+)\s+{noun}\b.*?\bby\s+(?:the\s+)?{column}\b",
+                f"{order} {{value}}", 0.9, tables=(table,)
+            ))
+            rules.append(IntentRule(
+                f"highest_{label}_by_{name.lower()}",
+                rf"\b(?:{TOP_WORDS}\s+{noun}\b.*?\bby|{noun}\b.*?\b{TOP_WORDS})\s+(?:the\s+)?{column}\b",
+                f"{order} {TOP_LIMIT}", 0.85, tables=(table,)
+            ))
+
+        for name in categorical:
+            column = column_pattern(name)
+            condition = f"WHERE {quote(name)} = '{{value}}'"
+            # "customers from France", "orders with status shipped", "offices where the country is USA"
+            filtered = (
+                rf"{noun}\b.*?\b(?:from|in|with|where|whose)\s+"
+                rf"(?:(?:the\s+)?{column}\s+(?:is\s+|of\s+|=\s*)?)?{VALUE_CAPTURE}"
+            )
+            rules.append(IntentRule(
+                f"{label}_where_{name.lower()}", rf"\b{filtered}",
+                f"SELECT * FROM {source} {condition} LIMIT {LIST_LIMIT}", 0.9, name.lower(),
+                f"SELECT {public_select} FROM {source} {condition} LIMIT {LIST_LIMIT}", (table,)
+            ))
+            rules.append(IntentRule(
+                f"count_{label}_where_{name.lower()}", rf"\b{COUNT_WORDS}{filtered}",
+                f"SELECT COUNT(*) AS total_{label} FROM {source} {condition}", 0.95, name.lower(), tables=(table,)
+            ))
+            # "how many open tickets", "show french customers"
+            rules.append(IntentRule(
+                f"{label}_{name.lower()}_before", rf"\b{LIST_WORDS}\s+(?:the\s+)?{VALUE_BEFORE}{noun}\b",
+                f"SELECT * FROM {source} {condition} LIMIT {LIST_LIMIT}", 0.9, name.lower(),
+                f"SELECT {public_select} FROM {source} {condition} LIMIT {LIST_LIMIT}", (table,)
+            ))
+            rules.append(IntentRule(
+                f"count_{label}_{name.lower()}_before", rf"\b{COUNT_WORDS}{VALUE_BEFORE}{noun}\b",
+                f"SELECT COUNT(*) AS total_{label} FROM {source} {condition}", 0.95, name.lower(), tables=(table,)
+            ))
+            rules.append(IntentRule(
+                f"count_{label}_by_{name.lower()}", rf"\b{noun}\b.*?\b(?:by|per|each)\s+{column}\b",
+                f"SELECT {quote(name)}, COUNT(*) AS total_{label} FROM {source} "
+                f"GROUP BY {quote(name)} ORDER BY total_{label} DESC", 0.9, tables=(table,)
+            ))
+
+        # Every rule of a table needs its noun, so only questions naming the table evaluate them
+        keywords = noun_keywords(table)
+        rules[first_rule:] = [rule._replace(keywords=keywords) for rule in rules[first_rule:]]
+    return rules
+
+
+# Used when no schema is known; DatabaseManager builds one from the database at connect time
+default_intent_engine = IntentEngine([])
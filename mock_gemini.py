@@ -0,0 +1,285 @@
+"""Local stand-in for the Gemini API, for offline load and latency tests.
+
+    python mock_gemini.py --port 8765 --latency-ms 800 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta/models/gemini-2.0-flash:generateContent streamlit run app.py
+
+Speaks the request and response shapes the app uses: generateContent,
+streamGenerateContent (server-sent events over chunked encoding) and
+cachedContents create/extend. Latency is log-normal around a median,
+errors are random 500s, and 429 bursts with Retry-After recur on a fixed
+period. Answers come from a JSON file of {question: sql} or, failing
+that, from a few rules over the question text, and are returned as JSON
+when the request asks for structured output.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+QUESTION_RE = re.compile(r"Now generate the SQL for: (.*)\s*$", re.DOTALL)
+
+
+class MockConfig:
+    """Behaviour of the mock server; every attribute can be changed while it runs"""
+
+    def __init__(self, latency_ms=500, latency_sigma=0.5, error_rate=0.0, burst_every=0,
+                 burst_seconds=0, retry_after=1, answers=None, chunk_chars=24, explain=True):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        # Every burst_every seconds, answer 429 for burst_seconds
+        self.burst_every = burst_every
+        self.burst_seconds = burst_seconds
+        self.retry_after = retry_after
+        self.answers = answers or {}
+        self.chunk_chars = chunk_chars
+        # Follow the SQL with prose, like the real model often does
+        self.explain = explain
+
+    def sample_latency(self):
+        """Seconds for one reply: log-normal with median latency_ms"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.latency_ms / 1000 * math.exp(random.gauss(0, self.latency_sigma))
+
+    def in_burst(self, now):
+        return self.burst_every > 0 and now % self.burst_every < self.burst_seconds
+
+
+def answer_sql(question, answers):
+    """Canned SQL for a question, else a rule-generated guess"""
+    sql = answers.get(question) or answers.get(question.lower())
+    if sql:
+        return sql
+
+    words = re.findall(r"[a-z_]+", question, re.IGNORECASE)
+    match = re.search(r"(?:how many|count|number of)\s+(?:total\s+)?([a-z_]+)", question, re.IGNORECASE)
+    if match:
+        return f"SELECT COUNT(*) AS total FROM {match.group(1)};"
+    match = re.search(r"top\s+(\d+)\s+([a-z_]+)(?:\s+by\s+([a-z_]+))?", question, re.IGNORECASE)
+    if match:
+        limit, table, column = match.groups()
+        order = f" ORDER BY {column} DESC" if column else ""
+        return f"SELECT * FROM {table}{order} LIMIT {limit};"
+    table = next((w for w in words if len(w) > 3 and w.endswith('s')), "dual")
+    return f"SELECT * FROM {table} LIMIT 20;"
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGemini/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_HEAD(self):
+        # Connection warm-up from GeminiClient
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PATCH(self):
+        body = self.read_json()
+        name = urlsplit(self.path).path.split("/v1beta/", 1)[-1]
+        self.send_json(200, {"name": name, "ttl": body.get("ttl")})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.read_json()
+        self.server.record(path)
+
+        if path.endswith("/cachedContents"):
+            name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+            self.server.contexts[name] = body
+            return self.send_json(200, {"name": name, "model": body.get("model")})
+
+        if not (path.endswith(":generateContent") or path.endswith(":streamGenerateContent")):
+            return self.send_json(404, {"error": {"code": 404, "message": f"Unknown path {path}"}})
+
+        config = self.config
+        if config.in_burst(time.time()):
+            return self.send_json(
+                429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}},
+                {"Retry-After": str(config.retry_after)}
+            )
+        if random.random() < config.error_rate:
+            time.sleep(config.sample_latency())
+            return self.send_json(500, {"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}})
+
+        cached = body.get("cachedContent")
+        if cached and cached not in self.server.contexts:
+            return self.send_json(404, {"error": {"code": 404, "message": f"{cached} not found"}})
+
+        text, finish_reason = self.apply_limits(self.reply_text(body), body.get("generationConfig", {}))
+        if path.endswith(":streamGenerateContent"):
+            self.stream(text, finish_reason)
+        else:
+            time.sleep(config.sample_latency())
+            self.send_json(200, self.response_body(text, finish_reason))
+
+    @staticmethod
+    def apply_limits(text, generation_config):
+        """Honour stopSequences and maxOutputTokens (about four characters per token)"""
+        for stop in generation_config.get("stopSequences", []):
+            index = text.find(stop)
+            if index >= 0:
+                text = text[:index]
+        max_chars = generation_config.get("maxOutputTokens", 8192) * 4
+        if len(text) > max_chars:
+            return text[:max_chars], "MAX_TOKENS"
+        return text, "STOP"
+
+    def reply_text(self, body):
+        prompt = "".join(
+            part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+        )
+        match = QUESTION_RE.search(prompt)
+        question = match.group(1).strip() if match else prompt.strip()
+        sql = answer_sql(question, self.config.answers)
+
+        if body.get("generationConfig", {}).get("responseMimeType") == "application/json":
+            tables = re.findall(r"\b(?:FROM|JOIN)\s+`?(\w+)", sql, re.IGNORECASE)
+            limit = re.search(r"LIMIT\s+(\d+)", sql, re.IGNORECASE)
+            return json.dumps({
+                "sql": sql,
+                "tables_used": tables,
+                "is_aggregate": bool(re.search(r"\b(COUNT|SUM|AVG|MIN|MAX)\s*\(", sql, re.IGNORECASE)),
+                "expected_row_bound": int(limit.group(1)) if limit else 1000
+            })
+
+        text = f"```sql\n{sql}\n```"
+        if self.config.explain:
+            text += "\nThis query answers the question by reading the relevant table and applying the requested filters."
+        return text
+
+    @staticmethod
+    def response_body(text, finish_reason=None):
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finish_reason:
+            candidate["finishReason"] = finish_reason
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {"candidatesTokenCount": len(text) // 4 + 1},
+            "modelVersion": "mock"
+        }
+
+    def stream(self, text, finish_reason="STOP"):
+        """Reply as server-sent events, time to first chunk then an even spread of the rest"""
+        config = self.config
+        total = config.sample_latency()
+        chunks = [text[i:i + config.chunk_chars] for i in range(0, len(text), config.chunk_chars)] or [""]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(total / 2)
+        try:
+            for i, chunk in enumerate(chunks):
+                last = i == len(chunks) - 1
+                event = json.dumps(self.response_body(chunk, finish_reason if last else None))
+                data = f"data: {event}\r\n\r\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+                if not last:
+                    time.sleep(total / 2 / len(chunks))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading once it had a complete statement
+            self.close_connection = True
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    """Threaded mock server; start() runs it in the background for tests and benchmarks"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None, model="gemini-2.0-flash"):
+        super().__init__((host, port), MockGeminiHandler)
+        self.config = config or MockConfig()
+        self.model = model
+        self.contexts = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    @property
+    def base_url(self):
+        """generateContent URL to give GeminiNL2SQL(base_url=...)"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta/models/{self.model}:generateContent"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local mock of the Gemini generateContent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500, help="median reply latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread, 0 for fixed latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds between 429 bursts, 0 for none")
+    parser.add_argument("--burst-seconds", type=float, default=0, help="length of each 429 burst")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with 429s")
+    parser.add_argument("--answers", help="JSON file mapping questions to SQL")
+    args = parser.parse_args(argv)
+
+    answers = {}
+    if args.answers:
+        with open(args.answers, encoding="utf-8") as f:
+            answers = json.load(f)
+
+    config = MockConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        burst_every=args.burst_every, burst_seconds=args.burst_seconds, retry_after=args.retry_after,
+        answers=answers
+    )
+    server = MockGeminiServer(args.host, args.port, config)
+    print(f"Mock Gemini listening; GEMINI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
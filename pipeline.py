@@ -0,0 +1,85 @@
+"""Asyncio front end to the generate-and-execute pipeline.
+
+    pipeline = NL2SQLPipeline(GeminiNL2SQL(api_key, quiet=True), db_manager)
+    result = await pipeline.ask("How many customers are from France?")
+
+Gemini and MySQL are reached through blocking clients (requests and
+SQLAlchemy/PyMySQL) that already keep their own connection pools, so
+ask() runs those two steps on small bounded thread pools instead of
+spawning a thread per question. Any number of questions can be awaited
+at once: the ones beyond the pool sizes wait in the executor queues
+without holding a thread, and generation for one question overlaps
+execution of another.
+"""
+import asyncio
+import functools
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+Result = namedtuple(
+    "Result", ["question", "sql", "data", "error", "generation_seconds", "execution_seconds"]
+)
+
+
+class NL2SQLPipeline:
+    """Answer questions with a GeminiNL2SQL agent and a connected DatabaseManager
+
+    The agent should be created with quiet=True: its status messages
+    cannot reach a Streamlit page from the worker threads.
+    """
+
+    def __init__(self, agent, db_manager, confidential_mode=False,
+                 generation_workers=8, execution_workers=4):
+        self.agent = agent
+        self.db_manager = db_manager
+        self.confidential_mode = confidential_mode
+        # Separate pools so slow Gemini calls never queue ahead of ready SQL
+        self._generation_executor = ThreadPoolExecutor(generation_workers, thread_name_prefix="nl2sql-generate")
+        self._execution_executor = ThreadPoolExecutor(execution_workers, thread_name_prefix="nl2sql-execute")
+
+    async def generate(self, question):
+        """SQL for a question; local intent rules, cache hits, Gemini or the local fallback"""
+        db = self.db_manager
+        generate = functools.partial(
+            self.agent.generate_sql_with_gemini,
+            question,
+            db.schema_info,
+            self.confidential_mode,
+            templater=db.question_templater,
+            table_fingerprints=db.table_fingerprints,
+            cache_namespace=db.cache_namespace,
+            schema_index=db.schema_index,
+            intent_engine=db.intent_engine
+        )
+        return await asyncio.get_running_loop().run_in_executor(self._generation_executor, generate)
+
+    async def execute(self, sql_query):
+        """DataFrame for a query, or an error message string as from execute_query"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._execution_executor, self.db_manager.execute_query, sql_query
+        )
+
+    async def ask(self, question):
+        """Generate SQL for a question, run it and return a Result"""
+        start = time.monotonic()
+        sql_query = await self.generate(question)
+        generated = time.monotonic()
+
+        data = await self.execute(sql_query)
+        executed = time.monotonic()
+
+        # execute_query reports failures as strings
+        error = data if isinstance(data, str) else None
+        return Result(
+            question, sql_query, None if error else data, error,
+            generated - start, executed - generated
+        )
+
+    async def ask_many(self, questions):
+        """Results in the order of questions, all in flight together"""
+        return await asyncio.gather(*(self.ask(question) for question in questions))
+
+    def close(self):
+        self._generation_executor.shutdown(wait=False)
+        self._execution_executor.shutdown(wait=False)
@@ -0,0 +1,106 @@
+"""Literal extraction so questions that differ only by a value share SQL.
+
+"customers from France" and "customers from Germany" normalise to the
+same template question, "customers from <country0>". The SQL generated
+for the first is stored with the literal replaced by a placeholder and
+re-bound with the new value on later hits.
+"""
+import re
+
+QUOTED_RE = re.compile(r"'([^']+)'|\"([^\"]+)\"")
+NUMBER_RE = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+SQL_STRING_RE = re.compile(r"'((?:[^'\\]|\\.|'')*)'")
+PLACEHOLDER_RE = re.compile(r"__lit(\d+)__")
+
+# Column names worth sampling for values users type into questions
+CATEGORICAL_HINTS = ('country', 'status', 'city', 'state', 'territory', 'line', 'title', 'type', 'category')
+
+
+class QuestionTemplater:
+    def __init__(self, literal_values=None):
+        # {lowercase value: (canonical value, category)}
+        self.literal_values = literal_values or {}
+        self._vocab_re = None
+        if self.literal_values:
+            # Longest first so "New Zealand" wins over "Zealand"
+            values = sorted(self.literal_values, key=len, reverse=True)
+            self._vocab_re = re.compile(
+                r"\b(" + "|".join(re.escape(v) for v in values) + r")\b", re.IGNORECASE
+            )
+
+    def parameterize(self, question):
+        """Return (template question, [(category, value), ...])"""
+        literals = []
+
+        def replace(category, value):
+            literals.append((category, value))
+            return f"<{category}{len(literals) - 1}>"
+
+        # Quoted strings first so their contents are not matched again
+        template = QUOTED_RE.sub(lambda m: replace('str', m.group(1) or m.group(2)), question)
+
+        if self._vocab_re is not None:
+            def vocab(match):
+                canonical, category = self.literal_values[match.group(1).lower()]
+                return replace(category, canonical)
+            template = self._vocab_re.sub(vocab, template)
+
+        template = NUMBER_RE.sub(lambda m: replace('num', m.group(0)), template)
+        return template.strip().lower(), literals
+
+    def to_sql_template(self, sql, literals):
+        """Replace each literal in the SQL with a placeholder
+
+        Returns None unless every literal appears exactly once, so an
+        ambiguous mapping is never cached.
+        """
+        if not literals:
+            return None
+
+        values = [value.lower() for _, value in literals]
+        if len(set(values)) != len(values):
+            return None
+
+        # Split into string literals and the code around them
+        pieces = []
+        last = 0
+        for match in SQL_STRING_RE.finditer(sql):
+            pieces.append(('code', sql[last:match.start()]))
+            pieces.append(('string', match.group(1)))
+            last = match.end()
+        pieces.append(('code', sql[last:]))
+
+        counts = [0] * len(literals)
+        output = []
+        for kind, text in pieces:
+            if kind == 'string':
+                for i, (category, value) in enumerate(literals):
+                    if category != 'num' and text.lower() == value.lower():
+                        counts[i] += 1
+                        text = f"__lit{i}__"
+                        break
+                output.append(f"'{text}'")
+            else:
+                def number(match):
+                    for i, (category, value) in enumerate(literals):
+                        if category == 'num' and match.group(0) == value:
+                            counts[i] += 1
+                            return f"__lit{i}__"
+                    return match.group(0)
+                output.append(NUMBER_RE.sub(number, text))
+
+        if any(count != 1 for count in counts):
+            return None
+        return "".join(output)
+
+    @staticmethod
+    def bind(sql_template, literals):
+        """Substitute literals back into a SQL template"""
+        def replace(match):
+            category, value = literals[int(match.group(1))]
+            if category == 'num':
+                return value
+            # MySQL treats backslash as an escape inside string literals
+            return value.replace("\\", "\\\\").replace("'", "''")
+
+        return PLACEHOLDER_RE.sub(replace, sql_template)
@@ -0,0 +1,157 @@
+"""Failure handling for calls to the Gemini API.
+
+Like cache.py, objects here are process-wide so every Streamlit session
+sees the same view of upstream health.
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Trip to the local fallback while the upstream is failing or slow
+
+    Tracks the outcome of the last `window` calls. Once at least
+    `min_calls` are recorded and the share of failures (errors plus calls
+    slower than `slow_call_seconds`) reaches `failure_rate_threshold`,
+    the breaker opens and rejects calls for `open_seconds`. It then lets
+    `half_open_max_calls` probes through: a success closes it again, a
+    failure re-opens it.
+    """
+
+    def __init__(self, window=20, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_seconds=10, open_seconds=30, half_open_max_calls=1):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh_state()
+            return self._state
+
+    def _refresh_state(self):
+        now = time.monotonic()
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            self._opened_at = now
+        elif self._state == HALF_OPEN and now - self._opened_at >= self.open_seconds:
+            # A probe that never reported back must not block the breaker forever
+            self._probes_in_flight = 0
+            self._opened_at = now
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+
+    def allow_request(self):
+        """Whether a call may go upstream now; half-open calls count as probes"""
+        with self._lock:
+            self._refresh_state()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record_success(self, latency):
+        """Record a completed call; slow successes count against the upstream"""
+        if latency >= self.slow_call_seconds:
+            self.record_failure(latency)
+            return
+
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self, latency=None):
+        """Record an error, timeout or slow call"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate_threshold:
+                    self._open()
+                    self._outcomes.clear()
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._probes_in_flight = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while
+    it is in flight block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        """Return (result, leader) where leader is True for the caller that ran fn"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, True
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Shared by every GeminiNL2SQL instance in this process
+gemini_circuit_breaker = CircuitBreaker()
+gemini_single_flight = SingleFlight()
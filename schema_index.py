@@ -0,0 +1,195 @@
+"""Pick the tables a question is about so the prompt carries only those.
+
+The index is built once per schema load from table and column names
+(split on camelCase and underscores), a few synonyms and the foreign key
+graph. A question is scored against it like a tiny search engine: rare
+terms count more than common ones, table-name hits more than column
+hits. The best tables plus the tables on the foreign key paths joining
+them are rendered up to a token budget; when nothing matches, or the
+whole schema fits the budget anyway, the full schema is used.
+"""
+import math
+import re
+from collections import defaultdict, deque
+
+# Digits are left out: "top 5" must not match audit_log_5
+IDENTIFIER_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])")
+WORD_RE = re.compile(r"[a-z]+")
+NAME_RE = re.compile(r"\w+_\w+")
+
+STOPWORDS = {
+    'a', 'all', 'an', 'and', 'are', 'by', 'each', 'for', 'from', 'give', 'has', 'have', 'how',
+    'in', 'is', 'list', 'many', 'me', 'much', 'of', 'on', 'or', 'per', 'show', 'the', 'their',
+    'there', 'to', 'what', 'which', 'who', 'with',
+}
+
+# Words people use for common schema concepts
+SYNONYMS = {
+    'client': ('customer',),
+    'buyer': ('customer',),
+    'staff': ('employee',),
+    'worker': ('employee',),
+    'rep': ('employee', 'sale'),
+    'item': ('product',),
+    'stock': ('quantity', 'product'),
+    'inventory': ('quantity', 'product'),
+    'sale': ('order', 'payment'),
+    'revenue': ('payment', 'amount', 'order'),
+    'purchase': ('order',),
+    'spend': ('payment', 'amount'),
+    'branch': ('office',),
+    'location': ('office', 'city', 'country'),
+    'category': ('line', 'type'),
+}
+
+# Score share of the best table a table needs to be picked on its own
+RELATIVE_SCORE_THRESHOLD = 0.4
+MAX_JOIN_PATH = 3
+
+
+def stem(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def identifier_terms(name):
+    """{'customerNumber'} -> {'customer', 'number'}, plus the whole name"""
+    terms = {stem(part.lower()) for part in IDENTIFIER_RE.findall(name)}
+    terms.add(stem(name.lower()))
+    return terms
+
+
+def question_terms(question):
+    terms = set()
+    for word in WORD_RE.findall(question.lower()):
+        if word in STOPWORDS:
+            continue
+        word = stem(word)
+        terms.add(word)
+        terms.update(SYNONYMS.get(word, ()))
+    # Identifiers typed as-is, e.g. "sample data from audit_log_3"
+    terms.update(stem(name) for name in NAME_RE.findall(question.lower()))
+    return terms
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English and identifiers
+    return len(text) // 4 + 1
+
+
+class SchemaIndex:
+    """Inverted index from name terms to tables, with the foreign key graph"""
+
+    def __init__(self, table_schemas, tables_info, foreign_keys=(), token_budget=1500):
+        # {table: "TABLE: ...\nCOLUMNS: ..."} in display order
+        self.table_schemas = table_schemas
+        self.foreign_keys = list(foreign_keys)
+        self.token_budget = token_budget
+        self.full_schema = "\n\n".join(table_schemas.values())
+
+        # term -> {table: weight}
+        self.postings = defaultdict(dict)
+        for table, columns in tables_info.items():
+            # Only tables the prompt can show; prune() looks each selected one up in table_schemas
+            if table not in table_schemas:
+                continue
+            for col in columns:
+                for term in identifier_terms(col['name']):
+                    self.postings[term][table] = max(self.postings[term].get(table, 0), 1.0)
+            for term in identifier_terms(table):
+                self.postings[term][table] = 3.0
+
+        self.neighbours = defaultdict(set)
+        for table, _, ref_table, _ in self.foreign_keys:
+            if table != ref_table:
+                self.neighbours[table].add(ref_table)
+                self.neighbours[ref_table].add(table)
+
+    def score(self, question, extra_terms=()):
+        """{table: relevance} for tables sharing a term with the question"""
+        terms = question_terms(question)
+        for term in extra_terms:
+            terms.update(identifier_terms(term))
+
+        scores = defaultdict(float)
+        table_count = len(self.table_schemas)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + table_count / len(postings))
+            for table, weight in postings.items():
+                scores[table] += idf * weight
+        return dict(scores)
+
+    def join_path(self, start, goal):
+        """Tables on a shortest foreign key path between two tables, None if too far apart"""
+        previous = {start: None}
+        queue = deque([(start, 0)])
+        while queue:
+            table, depth = queue.popleft()
+            if table == goal:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path
+            if depth == MAX_JOIN_PATH:
+                continue
+            for neighbour in self.neighbours[table]:
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append((neighbour, depth + 1))
+        return None
+
+    def select_tables(self, question, extra_terms=()):
+        """Tables to show for a question in priority order, [] when nothing matches"""
+        scores = self.score(question, extra_terms)
+        if not scores:
+            return []
+
+        best = max(scores.values())
+        seeds = sorted(
+            (table for table, score in scores.items() if score >= best * RELATIVE_SCORE_THRESHOLD),
+            key=lambda table: -scores[table]
+        )
+
+        selected = list(seeds)
+        # Tables needed to join the best match to the others
+        for seed in seeds[1:]:
+            path = self.join_path(seeds[0], seed) or []
+            selected.extend(table for table in path if table not in selected)
+        return selected
+
+    def prune(self, question, extra_terms=()):
+        """Schema text for the prompt: relevant tables within the token budget, else the full schema"""
+        if estimate_tokens(self.full_schema) <= self.token_budget:
+            return self.full_schema
+
+        tables = self.select_tables(question, extra_terms)
+        if not tables:
+            return self.full_schema
+
+        chosen = []
+        used = 0
+        for table in tables:
+            cost = estimate_tokens(self.table_schemas[table])
+            if chosen and used + cost > self.token_budget:
+                continue
+            chosen.append(table)
+            used += cost
+
+        # Original order reads better and keeps prompts for the same tables identical
+        chosen_set = set(chosen)
+        parts = [schema for table, schema in self.table_schemas.items() if table in chosen_set]
+        relationships = [
+            f"- {table}.{column} → {ref_table}.{ref_column}"
+            for table, column, ref_table, ref_column in self.foreign_keys
+            if table in chosen_set and ref_table in chosen_set
+        ]
+        if relationships:
+            parts.append("RELATIONSHIPS:\n" + "\n".join(relationships))
+        return "\n\n".join(parts)
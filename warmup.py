@@ -0,0 +1,97 @@
+"""Background warming and refreshing of the Gemini cache."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import DEFAULT_TTL_SECONDS
+
+
+class CacheWarmer:
+    """Generate SQL for known prompts off the script thread
+
+    One job runs per scope (a database) at a time. A scope is warmed
+    again when its schema fingerprint changes or the previous run is
+    close to falling out of the cache TTL.
+    """
+
+    def __init__(self, max_workers=4, ttl=DEFAULT_TTL_SECONDS):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._warmed = {}  # scope -> (schema fingerprint, started at)
+        self._running = set()
+
+    def needs_warming(self, scope, fingerprint):
+        with self._lock:
+            if scope in self._running:
+                return False
+            previous = self._warmed.get(scope)
+            if previous is None:
+                return True
+            last_fingerprint, started_at = previous
+            return last_fingerprint != fingerprint or time.time() - started_at >= self.ttl * 0.9
+
+    def ensure_warm(self, scope, fingerprint, prompts, generate):
+        """Start a background job calling generate(prompt) for each prompt if needed"""
+        if not self.needs_warming(scope, fingerprint):
+            return False
+
+        with self._lock:
+            if scope in self._running:
+                return False
+            self._running.add(scope)
+            self._warmed[scope] = (fingerprint, time.time())
+
+        thread = threading.Thread(
+            target=self._run, args=(scope, list(prompts), generate),
+            name="gemini-cache-warmup", daemon=True
+        )
+        thread.start()
+        return True
+
+    def _run(self, scope, prompts, generate):
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for future in [executor.submit(generate, prompt) for prompt in prompts]:
+                    try:
+                        future.result()
+                    except Exception:
+                        # A prompt that fails to warm is simply generated on first click
+                        pass
+        finally:
+            with self._lock:
+                self._running.discard(scope)
+
+
+class BackgroundRefresher:
+    """Refresh stale cache entries off the request path, one job per key"""
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-cache-refresh")
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def submit(self, key, fn):
+        """Schedule fn unless a refresh for key is already queued or running"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        def run():
+            try:
+                fn()
+            except Exception:
+                # The stale entry keeps being served until a refresh succeeds
+                pass
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+        return True
+
+
+# Shared across sessions so several users connecting do not warm twice
+cache_warmer = CacheWarmer()
+background_refresher = BackgroundRefresher()